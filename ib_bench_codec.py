@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark: per-row cost of decoding and encoding tuples.
+
+Compares:
+- legacy: per-column metadata lookup and type dispatch, as BaseTuple used to
+  do on every access
+- column: tpl[i] for each column, through prebound column codecs
+- row: tpl.getRow() / tpl.setRow(), one loop over prebound column codecs
+"""
+import ctypes
+import time
+import innodb
+import libinnodb
+import test0aux
+
+DATABASE = 'test'
+TABLE = 'bench_codec'
+ROW_COUNT = 10000
+INT_COLUMN_COUNT = 8
+VARCHAR_COLUMN_COUNT = 8
+
+_legacy_read_int = {
+    (1, libinnodb.IB_COL_UNSIGNED): innodb.tuple_read_u8,
+    (1, libinnodb.IB_COL_NONE): innodb.tuple_read_i8,
+    (2, libinnodb.IB_COL_UNSIGNED): innodb.tuple_read_u16,
+    (2, libinnodb.IB_COL_NONE): innodb.tuple_read_i16,
+    (4, libinnodb.IB_COL_UNSIGNED): innodb.tuple_read_u32,
+    (4, libinnodb.IB_COL_NONE): innodb.tuple_read_i32,
+    (8, libinnodb.IB_COL_UNSIGNED): innodb.tuple_read_u64,
+    (8, libinnodb.IB_COL_NONE): innodb.tuple_read_i64,
+}
+
+_legacy_write_int = {
+    (1, libinnodb.IB_COL_UNSIGNED): innodb.tuple_write_u8,
+    (1, libinnodb.IB_COL_NONE): innodb.tuple_write_i8,
+    (2, libinnodb.IB_COL_UNSIGNED): innodb.tuple_write_u16,
+    (2, libinnodb.IB_COL_NONE): innodb.tuple_write_i16,
+    (4, libinnodb.IB_COL_UNSIGNED): innodb.tuple_write_u32,
+    (4, libinnodb.IB_COL_NONE): innodb.tuple_write_i32,
+    (8, libinnodb.IB_COL_UNSIGNED): innodb.tuple_write_u64,
+    (8, libinnodb.IB_COL_NONE): innodb.tuple_write_i64,
+}
+
+def legacy_column_list(tpl):
+    result = []
+    for index in xrange(innodb.tuple_get_n_cols(tpl)):
+        data_len, col_meta = innodb.col_get_meta(tpl, index)
+        if col_meta.type == libinnodb.IB_SYS:
+            continue
+        result.append((index, data_len, col_meta))
+    return result
+
+def legacy_read_row(tpl):
+    # Metadata was re-read after each cursor read.
+    column_list = legacy_column_list(tpl)
+    result = []
+    for column in xrange(len(column_list)):
+        index, data_len, col_meta = column_list[column]
+        col_type = col_meta.type
+        if data_len == libinnodb.IB_SQL_NULL:
+            value = None
+        elif col_type == libinnodb.IB_INT:
+            value = _legacy_read_int[col_meta.type_len,
+                col_meta.attr & libinnodb.IB_COL_UNSIGNED](tpl, index)
+        elif col_type == libinnodb.IB_VARCHAR:
+            value = ctypes.string_at(innodb.col_get_value(tpl, index),
+                data_len)
+        else:
+            raise NotImplementedError(repr(col_type))
+        result.append(value)
+    return result
+
+def legacy_write_row(tpl, row):
+    column_list = legacy_column_list(tpl)
+    for column, value in enumerate(row):
+        index, data_len, col_meta = column_list[column]
+        col_type = col_meta.type
+        if col_type == libinnodb.IB_INT:
+            _legacy_write_int[col_meta.type_len,
+                col_meta.attr & libinnodb.IB_COL_UNSIGNED](tpl, index, value)
+        else:
+            innodb.col_set_value(tpl, index, value, len(value))
+        # Metadata was re-read after each column assignment.
+        column_list = legacy_column_list(tpl)
+
+def column_read_row(tpl):
+    return [tpl[x] for x in xrange(len(tpl))]
+
+def column_write_row(tpl, row):
+    for column, value in enumerate(row):
+        tpl[column] = value
+
+def row_read_row(tpl):
+    return tpl.getRow()
+
+def row_write_row(tpl, row):
+    tpl.setRow(row)
+
+def create_table(txn, table):
+    column_list = [('i%i' % x, libinnodb.IB_INT, 4, libinnodb.IB_COL_UNSIGNED)
+        for x in xrange(INT_COLUMN_COUNT)]
+    column_list.extend(('v%i' % x, libinnodb.IB_VARCHAR, 32)
+        for x in xrange(VARCHAR_COLUMN_COUNT))
+    table_sch = table.newSchema(column_list=column_list)
+    table_sch.newIndex('PRIMARY', (('i0', ), ), clustered=True)
+    txn.begin()
+    txn.lockSchema(True)
+    table_sch.create(txn)
+    txn.commit()
+
+def make_row(i):
+    return [i] * INT_COLUMN_COUNT + ['value %i' % i] * VARCHAR_COLUMN_COUNT
+
+def bench_write(crsr, write_row):
+    tpl = crsr.getReadTuple()
+    begin = time.time()
+    for i in xrange(ROW_COUNT):
+        write_row(tpl, make_row(i))
+        tpl.clear()
+    return time.time() - begin
+
+def bench_read(crsr, read_row):
+    tpl = crsr.getReadTuple()
+    crsr.goFirst()
+    begin = time.time()
+    for tpl in crsr.iterForward():
+        read_row(tpl)
+    return time.time() - begin
+
+def report(caption, duration):
+    print '%-12s %8.2f us/row' % (caption, duration * 1000000 / ROW_COUNT)
+
+def main():
+    idb = innodb.InnoDB()
+    test0aux.test_configure()
+    idb.startup('barracuda')
+    db = idb[DATABASE]
+    db.create()
+    table = db[TABLE]
+    txn = innodb.Transaction(libinnodb.IB_TRX_REPEATABLE_READ)
+    create_table(txn, table)
+    txn.begin()
+    crsr = table.open(txn)
+    crsr.lockTable(libinnodb.IB_LOCK_IX)
+    crsr.insertRows(make_row(i) for i in xrange(ROW_COUNT))
+    print '%i rows, %i INT + %i VARCHAR columns' % (ROW_COUNT,
+        INT_COLUMN_COUNT, VARCHAR_COLUMN_COUNT)
+    print 'Encode'
+    report('legacy', bench_write(crsr, lambda tpl, row: legacy_write_row(
+        tpl._tuple, row)))
+    report('column', bench_write(crsr, column_write_row))
+    report('row', bench_write(crsr, row_write_row))
+    print 'Decode'
+    for caption, read_row in (
+                ('legacy', lambda tpl: legacy_read_row(tpl._tuple)),
+                ('column', column_read_row),
+                ('row', row_read_row),
+            ):
+        report(caption, bench_read(crsr, read_row))
+    crsr.close()
+    txn.commit()
+    txn.begin()
+    txn.lockSchema(True)
+    table.drop(txn)
+    txn.commit()
+    idb.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+Benchmark: storing compressible BLOB payloads.
+
+Compares column value codecs (applied by the bindings) with InnoDB
+compressed table format at several page sizes, reporting tablespace size,
+buffer pool usage and I/O for a load followed by a full scan.
+"""
+import os
+import time
+import innodb
+import libinnodb
+import test0aux
+
+DATABASE = 'test'
+ROW_COUNT = 20000
+SAMPLE_COUNT = 500
+
+def make_payload(i):
+    return ''.join(
+        '{"id": %i, "user": "user%i", "status": "%s", "country": "%s", '
+        '"tags": ["alpha", "beta", "gamma"], "score": %i}\n' % (
+            i * 10 + x, (i * 7 + x) % 1000, ('active', 'idle')[x % 2],
+            ('FR', 'DE', 'US', 'JP')[(i + x) % 4], (i * x) % 100)
+        for x in xrange(4 + i % 8))
+
+def get_variant_list():
+    dictionary = innodb.train_zlib_dictionary(
+        make_payload(x) for x in xrange(SAMPLE_COUNT))
+    compact = libinnodb.IB_TBL_COMPACT
+    compressed = libinnodb.IB_TBL_COMPRESSED
+    return [
+        ('plain', compact, 0, None),
+        ('passthrough', compact, 0, innodb.PassThroughColumnCodec()),
+        ('zlib-1', compact, 0, innodb.ZlibColumnCodec(level=1)),
+        ('zlib-6', compact, 0, innodb.ZlibColumnCodec(level=6)),
+        ('zlib-9', compact, 0, innodb.ZlibColumnCodec(level=9)),
+        ('zlib-dict', compact, 0, innodb.ZlibDictColumnCodec(dictionary)),
+        ('compressed-4k', compressed, 4, None),
+        ('compressed-8k', compressed, 8, None),
+        ('compressed-16k', compressed, 16, None),
+    ]
+
+STATUS_LIST = (
+    'buffer_pool_data_pages',
+    'buffer_pool_read_reqs',
+    'buffer_pool_reads',
+    'buffer_pool_write_reqs',
+    'read_req_done',
+    'write_req_done',
+    'bytes_total_read',
+    'bytes_total_written',
+)
+
+def create_table(txn, table, fmt, page_size, codec):
+    table_sch = table.newSchema(fmt, page_size, column_list=(
+        ('id', libinnodb.IB_INT, 4, libinnodb.IB_COL_UNSIGNED),
+        ('payload', libinnodb.IB_BLOB, 0, libinnodb.IB_COL_NONE, 0, codec),
+    ))
+    table_sch.newIndex('PRIMARY', (('id', ), ), clustered=True)
+    txn.begin()
+    txn.lockSchema(True)
+    table_sch.create(txn)
+    txn.commit()
+
+def load(table):
+    txn = innodb.Transaction(libinnodb.IB_TRX_REPEATABLE_READ)
+    txn.begin()
+    crsr = table.open(txn)
+    count = crsr.bulkLoad((i, make_payload(i)) for i in xrange(ROW_COUNT))
+    crsr.close()
+    txn.commit()
+    return count
+
+def scan(table):
+    txn = innodb.Transaction(libinnodb.IB_TRX_REPEATABLE_READ)
+    txn.begin()
+    crsr = table.open(txn, read_only=True)
+    crsr.goFirst()
+    total = 0
+    for row in crsr.iterRows():
+        total += len(row[1])
+    crsr.close()
+    txn.commit()
+    return total
+
+def get_status(idb):
+    status_dict = idb.getStatusDict()
+    return dict((x, status_dict[x]) for x in STATUS_LIST)
+
+def report(caption, duration, after, before):
+    print '  %-8s %8.2f s  %s' % (caption, duration, '  '.join(
+        '%s=%i' % (x, after[x] - before[x]) for x in STATUS_LIST
+        if x != 'buffer_pool_data_pages'))
+
+def bench(idb, db, name, fmt, page_size, codec):
+    table_name = 'bench_' + name.replace('-', '_')
+    table = db[table_name]
+    txn = innodb.Transaction(libinnodb.IB_TRX_REPEATABLE_READ)
+    create_table(txn, table, fmt, page_size, codec)
+    print name
+    before = get_status(idb)
+    begin = time.time()
+    load(table)
+    middle = time.time()
+    loaded = get_status(idb)
+    payload_size = scan(table)
+    end = time.time()
+    scanned = get_status(idb)
+    report('load', middle - begin, loaded, before)
+    report('scan', end - middle, scanned, loaded)
+    print '  payload %i bytes, tablespace %i bytes, buffer pool pages %i' % (
+        payload_size,
+        os.path.getsize('%s/%s.ibd' % (DATABASE, table_name)),
+        scanned['buffer_pool_data_pages'])
+    txn.begin()
+    txn.lockSchema(True)
+    table.drop(txn)
+    txn.commit()
+
+def main():
+    idb = innodb.InnoDB()
+    test0aux.test_configure()
+    idb.startup('barracuda')
+    db = idb[DATABASE]
+    db.create()
+    for name, fmt, page_size, codec in get_variant_list():
+        bench(idb, db, name, fmt, page_size, codec)
+    idb.shutdown()
+
+if __name__ == '__main__':
+    main()
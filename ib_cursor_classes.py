@@ -47,6 +47,32 @@ def print_lt_5(tpl):
         test0aux.print_tuple(sys.stdout, tpl._tuple)
     return result
 
+def print_rows(row_iterator):
+    for row in row_iterator:
+        print '|'.join(str(x) for x in row) + '|'
+
+def check_predicates(crsr):
+    # Run each predicate operator once.
+    for where, expected in (
+                ([('c1', '=', 5)], [5]),
+                ([('c1', '!=', 5)], [0, 1, 2, 3, 4, 6, 7, 8, 9]),
+                ([('c1', '<', 2)], [0, 1]),
+                ([('c1', '<=', 2)], [0, 1, 2]),
+                ([('c1', '>', 7)], [8, 9]),
+                ([('c1', '>=', 7)], [7, 8, 9]),
+                ([('c1', 'in', (3, 6, 42))], [3, 6]),
+                ([('c1', 'is null')], []),
+                ([('c1', 'is not null')], range(10)),
+            ):
+        result = [x for x, in crsr.range(where=where)]
+        assert result == expected, (where, result)
+    try:
+        list(crsr.range(where=[('c1', 'prefix', '1')]))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('prefix accepted on integer column')
+
 def main():
     idb = innodb.InnoDB()
     test0aux.test_configure()
@@ -79,6 +105,17 @@ def main():
     tpl[0] = 1
     crsr.goTo(tpl, libinnodb.IB_CUR_GE)
     iterate(crsr, print_lt_5)
+    print 'SELECT * FROM T WHERE c1 >= 1 AND c1 < 5; (using range)'
+    print_rows(crsr.range(low=(1, ), high=(5, )))
+    print 'SELECT * FROM T WHERE c1 > 5 ORDER BY c1 DESC; (using range)'
+    print_rows(crsr.range(low=(5, ), low_inclusive=False, reverse=True))
+    print 'SELECT * FROM T WHERE c1 IN (2, 7, 9); (using predicates)'
+    crsr.setColumnNameList(('c1', ))
+    print_rows(crsr.range(where=[('c1', 'in', (2, 7, 9))]))
+    print 'SELECT * FROM T WHERE c1 < 3 AND c1 != 1; (using predicates)'
+    crsr.goFirst()
+    print_rows(crsr.iterRows(where=[('c1', '<', 3), ('c1', '!=', 1)]))
+    check_predicates(crsr)
     crsr.close()
     txn.commit()
     txn.begin()
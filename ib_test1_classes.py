@@ -27,18 +27,9 @@ def do_query(crsr):
         print
 
 def update_a_row(crsr):
-    key_tpl = crsr.getSearchTuple()
-    key_tpl[0] = 'a'
-    res = crsr.goTo(key_tpl)
-    assert res == -1
-    new_tpl = crsr.getReadTuple()
-    for old_tpl in crsr.iterForward():
-        if old_tpl[0] != 'a':
-            break
-        new_tpl.copy(old_tpl)
-        new_tpl[2] = old_tpl[2] + 100
-        crsr.update(old_tpl, new_tpl)
-        new_tpl.clear()
+    count = crsr.updateRange(('a', ), ('a', ),
+        lambda row: row[:2] + (row[2] + 100, ), high_inclusive=True)
+    assert count == 2, count
 
 def delete_a_row(crsr):
     key_tpl = crsr.getSearchTuple()
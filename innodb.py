@@ -1,5 +1,17 @@
 import ctypes
+import heapq
+import operator
 import platform
+import Queue
+import sys
+import tempfile
+import threading
+import time
+import cPickle
+import contextlib
+import mmap
+import zlib
+from collections import namedtuple
 import libinnodb
 
 class InnoDBError(Exception):
@@ -29,6 +41,8 @@ tuple_clear = libinnodb.ib_tuple_clear
 tuple_delete = libinnodb.ib_tuple_delete
 tuple_get_n_cols = libinnodb.ib_tuple_get_n_cols
 col_get_value = libinnodb.ib_col_get_value
+col_get_len = libinnodb.ib_col_get_len
+col_copy_value = libinnodb.ib_col_copy_value
 def database_create(name):
     if not libinnodb.ib_database_create(name):
         raise InnoDBError(libinnodb.DB_ERROR)
@@ -65,6 +79,32 @@ for func_name in dir(libinnodb):
     if getattr(func, 'restype', None) is ib_err_t:
         _global_dict[dest_func_name] = new_wrapper(func)
 
+_end_of_scan_set = frozenset((
+    libinnodb.DB_END_OF_INDEX,
+    libinnodb.DB_RECORD_NOT_FOUND,
+))
+
+def new_scan_wrapper(func):
+    """
+    Like new_wrapper, but end-of-scan conditions (DB_END_OF_INDEX,
+    DB_RECORD_NOT_FOUND) are returned instead of raised, along with
+    DB_SUCCESS. Avoids exception creation overhead when reaching the end of
+    a scan.
+    """
+    def wrapped(*args):
+        res = func(*args).value
+        if res != DB_SUCCESS and res not in _end_of_scan_set:
+            raise InnoDBError(res)
+        return res
+    return wrapped
+
+try_cursor_read_row = new_scan_wrapper(libinnodb.ib_cursor_read_row)
+try_cursor_first = new_scan_wrapper(libinnodb.ib_cursor_first)
+try_cursor_last = new_scan_wrapper(libinnodb.ib_cursor_last)
+try_cursor_next = new_scan_wrapper(libinnodb.ib_cursor_next)
+try_cursor_prev = new_scan_wrapper(libinnodb.ib_cursor_prev)
+try_cursor_moveto = new_scan_wrapper(libinnodb.ib_cursor_moveto)
+
 if platform.system() == 'Windows':
     # TODO: until this is implemented, each cfg_get_all call will leak some
     # memory (also true for ib_status_get_all).
@@ -332,12 +372,36 @@ class Database(object):
         _checkName(name)
         return Table('%s/%s' % (self._name, name))
 
+# Column value codecs by table name, then by table column position.
+# See Table.setColumnCodecDict .
+_table_codec_dict = {}
+
 class Table(object):
     def __init__(self, name):
         self._name = name
 
     def drop(self, transaction):
         table_drop(transaction._txn_id, self._name)
+        _table_codec_dict.pop(self._name, None)
+
+    def setColumnCodecDict(self, codec_dict):
+        """
+        Register value codecs (see ZlibColumnCodec), by table column
+        position, to apply on all cursors opened on this table from now on
+        (including secondary index cursors reading clustered records, and
+        CursorCache cursors).
+        Codecs are not stored in the database: they must be registered
+        again after each startup. TableSchema.create registers those
+        declared with TableSchema.addColumn .
+        An empty codec_dict unregisters codecs.
+        """
+        if codec_dict:
+            _table_codec_dict[self._name] = dict(codec_dict)
+        else:
+            _table_codec_dict.pop(self._name, None)
+
+    def getColumnCodecDict(self):
+        return dict(_table_codec_dict.get(self._name, ()))
 
     def dropIndex(self, transaction, name):
         index_drop(transaction._txn_id, self._getIndexId(name))
@@ -347,11 +411,177 @@ class Table(object):
         table_truncate(self._name, ctypes.byref(table_id))
         # TODO: notify cursor instances of table truncation ?
 
-    def open(self, transaction, read_only=False):
-        return TableCursor(self._name, transaction, read_only)
+    def open(self, transaction, read_only=False, key_position_list=None,
+            column_codec_dict=None):
+        """
+        column_codec_dict defaults to codecs registered for this table, see
+        setColumnCodecDict .
+        """
+        result = TableCursor(self._name, transaction, read_only)
+        if key_position_list is not None:
+            result.setKeyPositionList(key_position_list)
+        if column_codec_dict is None:
+            column_codec_dict = _table_codec_dict.get(self._name)
+        if column_codec_dict:
+            result.setColumnCodecDict(column_codec_dict)
+        return result
 
-    def openSecondaryIndex(self, transaction, name, read_only=False):
-        return IndexCursor(self._getIndexId(name), transaction, read_only)
+    def _runParallel(self, boundary_list, partition_function, worker_count,
+            level, key_position_list):
+        """
+        Call partition_function(cursor, low, high) for each key range
+        delimited by boundary_list, from worker_count threads.
+        Each worker uses its own read-only transaction and cursor.
+        Returns partition_function results, in key range order.
+        """
+        boundary_list = [None] + list(boundary_list) + [None]
+        partition_queue = Queue.Queue()
+        for partition in xrange(len(boundary_list) - 1):
+            partition_queue.put(partition)
+        result_list = [None] * (len(boundary_list) - 1)
+        error_list = []
+        def worker():
+            try:
+                transaction = Transaction(level)
+                transaction.begin()
+                try:
+                    cursor = self.open(transaction, read_only=True,
+                        key_position_list=key_position_list)
+                    try:
+                        while not error_list:
+                            try:
+                                partition = partition_queue.get_nowait()
+                            except Queue.Empty:
+                                break
+                            result_list[partition] = partition_function(
+                                cursor,
+                                boundary_list[partition],
+                                boundary_list[partition + 1],
+                            )
+                    finally:
+                        cursor.close()
+                finally:
+                    transaction.commit()
+            except:
+                error_list.append(sys.exc_info())
+        thread_list = [threading.Thread(target=worker)
+            for _ in xrange(min(worker_count, len(result_list)))]
+        for thread in thread_list:
+            thread.daemon = True
+            thread.start()
+        for thread in thread_list:
+            thread.join()
+        if error_list:
+            exc_type, exc_value, exc_traceback = error_list[0]
+            raise exc_type, exc_value, exc_traceback
+        return result_list
+
+    def mapReduceParallel(self, boundary_list, map_function, reduce_function,
+            worker_count=4, level=libinnodb.IB_TRX_REPEATABLE_READ,
+            key_position_list=None):
+        """
+        Split table in key ranges and process them from parallel workers.
+
+        boundary_list is a sorted list of leading key column values, splitting
+        table in len(boundary_list) + 1 partitions (see
+        TableCursor.getKeyBoundaryList).
+        map_function receives an iterator over the rows of one partition, and
+        returns a partial result. Partial results are combined with
+        reduce_function(a, b) in key order.
+        Each worker reads from its own transaction, so partitions are not
+        read from a common snapshot.
+        """
+        def partition_function(cursor, low, high):
+            return map_function(cursor._iterPartition(low, high))
+        return reduce(reduce_function, self._runParallel(boundary_list,
+            partition_function, worker_count, level, key_position_list))
+
+    def aggregateParallel(self, boundary_list, name, position=None,
+            worker_count=4, level=libinnodb.IB_TRX_REPEATABLE_READ,
+            key_position_list=None):
+        """
+        Compute an aggregate over the whole table from parallel workers.
+        See BaseCursor.aggregate for name and position, and
+        mapReduceParallel for other parameters.
+        """
+        if position is None and name != 'count':
+            raise ValueError('position is required for %r' % (name, ))
+        _, _, merge, final = _aggregate_dict[name]
+        def partition_function(cursor, low, high):
+            if low is not None:
+                low = (low, )
+            if high is not None:
+                high = (high, )
+            return cursor._aggregateState(name, position, low, high, True,
+                False)
+        return final(reduce(merge, self._runParallel(boundary_list,
+            partition_function, worker_count, level, key_position_list)))
+
+    def scanParallel(self, boundary_list, worker_count=4,
+            level=libinnodb.IB_TRX_REPEATABLE_READ, queue_size=1024,
+            key_position_list=None):
+        """
+        Iterate over all table rows, read from parallel workers.
+
+        See mapReduceParallel for boundary_list.
+        Rows are not produced in key order. At most queue_size rows are
+        buffered between workers and caller.
+        """
+        row_queue = Queue.Queue(queue_size)
+        stop_event = threading.Event()
+        done = object()
+        def partition_function(cursor, low, high):
+            put = row_queue.put
+            for row in cursor._iterPartition(low, high):
+                while True:
+                    if stop_event.is_set():
+                        return
+                    try:
+                        put(row, timeout=0.1)
+                    except Queue.Full:
+                        continue
+                    break
+        result_list = []
+        def run():
+            try:
+                self._runParallel(boundary_list, partition_function,
+                    worker_count, level, key_position_list)
+            except:
+                result_list.append(sys.exc_info())
+            finally:
+                while not stop_event.is_set():
+                    try:
+                        row_queue.put(done, timeout=0.1)
+                    except Queue.Full:
+                        continue
+                    break
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        try:
+            get = row_queue.get
+            while True:
+                row = get()
+                if row is done:
+                    break
+                yield row
+        finally:
+            stop_event.set()
+            thread.join()
+        if result_list:
+            exc_type, exc_value, exc_traceback = result_list[0]
+            raise exc_type, exc_value, exc_traceback
+
+    def openSecondaryIndex(self, transaction, name, read_only=False,
+            table_position_list=None):
+        result = IndexCursor(self._getIndexId(name), transaction, read_only)
+        if table_position_list is not None:
+            result.setTablePositionList(table_position_list)
+        column_codec_dict = _table_codec_dict.get(self._name)
+        if column_codec_dict:
+            # Applies to clustered records, read with cluster access.
+            result.setColumnCodecDict(column_codec_dict)
+        return result
 
     def newSchema(self, fmt=libinnodb.IB_TBL_COMPACT, page_size=0,
             column_list=()):
@@ -370,7 +600,7 @@ class Table(object):
 
     def _getIndexId(self, name):
         index_id = libinnodb.ib_id_t()
-        index_get_id(self._name, name, ctypes.byref(ib_id_t))
+        index_get_id(self._name, name, ctypes.byref(index_id))
         return index_id.value
 
     def exists(self):
@@ -460,28 +690,177 @@ class Transaction(object):
             else:
                 self.rollback()
 
+class TransactionLimiter(object):
+    """
+    Bound on the number of concurrent transactions, handed out begun, by
+    isolation level.
+
+    Nothing is pooled: libinnodb frees transaction handles on commit and
+    rollback, so a new handle is allocated (trx_begin) on every acquire.
+    At most max_size transactions can be acquired at the same time, acquire
+    blocks (or raises Queue.Full if block is false) past that point.
+    """
+    def __init__(self, max_size=64):
+        self._semaphore = threading.Semaphore(max_size)
+
+    def acquire(self, level=libinnodb.IB_TRX_REPEATABLE_READ, block=True):
+        """
+        Return a begun transaction with given isolation level.
+        It must be given back with release.
+        """
+        if not self._semaphore.acquire(block):
+            raise Queue.Full
+        try:
+            transaction = Transaction(level)
+            transaction.begin()
+        except:
+            self._semaphore.release()
+            raise
+        return transaction
+
+    def release(self, transaction):
+        """
+        Give back a transaction obtained from acquire. It is rolled back if
+        it was neither committed nor rolled back.
+        """
+        try:
+            if transaction._txn_id is not None:
+                transaction.rollback()
+        finally:
+            self._semaphore.release()
+
+    @contextlib.contextmanager
+    def transaction(self, level=libinnodb.IB_TRX_REPEATABLE_READ):
+        """
+        Context manager providing a begun transaction, committed on exit or
+        rolled back if an exception escapes.
+        Committing or rolling back explicitly inside the block is allowed.
+        """
+        transaction = self.acquire(level)
+        try:
+            try:
+                yield transaction
+            except:
+                if transaction._txn_id is not None:
+                    transaction.rollback()
+                raise
+            else:
+                if transaction._txn_id is not None:
+                    transaction.commit()
+        finally:
+            self.release(transaction)
+
 class TableSchema(object):
     def __init__(self, name, fmt=libinnodb.IB_TBL_COMPACT, page_size=0):
         self._schema = schema = libinnodb.ib_tbl_sch_t()
         self._index_list = []
+        self._index_dict = {}
+        self._column_list = []
+        self._name = name
+        self._codec_dict = {}
         table_schema_create(name, ctypes.byref(schema), fmt, page_size)
 
     def create(self, transaction):
         table_id = libinnodb.ib_id_t()
         table_create(transaction._txn_id, self._schema, ctypes.byref(table_id))
+        Table(self._name).setColumnCodecDict(self._codec_dict)
 
     def addColumn(self, name, col_type, length,
-            attributes=libinnodb.IB_COL_NONE, client=0):
+            attributes=libinnodb.IB_COL_NONE, client=0, codec=None):
+        """
+        codec
+          Value codec (ex: ZlibColumnCodec) for string-ish columns.
+          Registered for the table by create, see Table.setColumnCodecDict .
+        """
+        if codec is not None and col_type not in _string_type_set:
+            raise TypeError('Value codec on non-string column %r' % (name, ))
         table_schema_add_col(self._schema, name, col_type, attributes, client,
             length)
+        if codec is not None:
+            self._codec_dict[len(self._column_list)] = codec
+        self._column_list.append((name, col_type, length, attributes))
+
+    def getColumnCodecDict(self):
+        """
+        Return declared value codecs by table column position.
+        See Table.open and BaseCursor.setColumnCodecDict .
+        """
+        return self._codec_dict.copy()
 
     def newIndex(self, name, column_list=(), clustered=False, unique=False):
         index_schema_id = libinnodb.ib_idx_sch_t()
         table_schema_add_index(self._schema, name,
             ctypes.byref(index_schema_id))
         self._index_list.append(index_schema_id)
-        return IndexSchema(index_schema_id, False, column_list, clustered,
-            unique)
+        self._index_dict[name] = result = IndexSchema(index_schema_id, False,
+            column_list, clustered, unique)
+        return result
+
+    def getColumnNameList(self):
+        return [x[0] for x in self._column_list]
+
+    def _getIndex(self, index_name):
+        if index_name is None:
+            for index in self._index_dict.itervalues():
+                if index._clustered:
+                    return index
+            raise ValueError('No clustered index declared')
+        return self._index_dict[index_name]
+
+    def getKeyPositionList(self, index_name=None):
+        """
+        Return the position in table rows of each column of given index, in
+        index order.
+        index_name defaults to the clustered index.
+        """
+        column_name_list = self.getColumnNameList()
+        return [column_name_list.index(name)
+            for name, _ in self._getIndex(index_name)._column_list]
+
+    def getSecondaryReadPositionList(self, index_name):
+        """
+        Return the table column position of each column of given secondary
+        index read tuples: index columns, then clustered index columns not
+        already part of it. Columns only indexed by a prefix are None.
+        See IndexCursor.setTablePositionList .
+        """
+        column_name_list = self.getColumnNameList()
+        result = []
+        full_set = set()
+        for name, prefix in self._getIndex(index_name)._column_list:
+            if prefix:
+                result.append(None)
+            else:
+                position = column_name_list.index(name)
+                result.append(position)
+                full_set.add(position)
+        for name, prefix in self._getIndex(None)._column_list:
+            position = column_name_list.index(name)
+            if position not in full_set:
+                result.append(position)
+                full_set.add(position)
+        return result
+
+    def getKeyFunction(self, index_name=None):
+        """
+        Return a function extracting from a table row a sort key matching
+        given index order (binary collation).
+        index_name defaults to the clustered index.
+        """
+        key_list = zip(self.getKeyPositionList(index_name),
+            [prefix for _, prefix in self._getIndex(index_name)._column_list])
+        if any(prefix for _, prefix in key_list):
+            def key(row):
+                return tuple([
+                    (row[position][:prefix]
+                        if prefix and row[position] is not None
+                        else row[position])
+                    for position, prefix in key_list])
+        else:
+            position_list = [position for position, _ in key_list]
+            def key(row):
+                return tuple([row[position] for position in position_list])
+        return key
 
     def __del__(self):
         if _is_started and self._schema:
@@ -492,6 +871,9 @@ class IndexSchema(object):
             clustered=False, unique=False):
         self._free_on_del = free_on_del
         self._schema = index_schema_id
+        self._column_list = []
+        self._clustered = False
+        self._unique = False
         for column_args in column_list:
             self.addColumn(*column_args)
         if clustered:
@@ -501,12 +883,15 @@ class IndexSchema(object):
 
     def addColumn(self, name, prefix=0):
         index_schema_add_col(self._schema, name, prefix)
+        self._column_list.append((name, prefix))
 
     def setClustered(self):
         index_schema_set_clustered(self._schema)
+        self._clustered = True
 
     def setUnique(self):
         index_schema_set_unique(self._schema)
+        self._unique = True
 
     def create(self):
         if not free_on_del:
@@ -521,86 +906,1049 @@ class IndexSchema(object):
         if self._free_on_del:
            index_schema_delete(self._schema)
 
+def _spillRun(item_list, tmp_dir):
+    run_file = tempfile.TemporaryFile(dir=tmp_dir)
+    dump = cPickle.Pickler(run_file, cPickle.HIGHEST_PROTOCOL).dump
+    for item in item_list:
+        dump(item)
+    run_file.seek(0)
+    return run_file
+
+def _iterRun(run_file):
+    load = cPickle.Unpickler(run_file).load
+    while True:
+        try:
+            yield load()
+        except EOFError:
+            break
+
+def _decorateRun(run, key, run_number):
+    for item in run:
+        yield key(item), run_number, item
+
+def external_sort(iterable, key, max_items_in_memory=100000, tmp_dir=None):
+    """
+    Iterate over items from iterable, in key order.
+
+    At most max_items_in_memory items are kept in memory: beyond that, sorted
+    runs are written (pickled) to temporary files in tmp_dir, and merged
+    when input is exhausted.
+    Sort is stable.
+    """
+    run_file_list = []
+    try:
+        item_list = []
+        append = item_list.append
+        for item in iterable:
+            append(item)
+            if len(item_list) >= max_items_in_memory:
+                item_list.sort(key=key)
+                run_file_list.append(_spillRun(item_list, tmp_dir))
+                item_list = []
+                append = item_list.append
+        item_list.sort(key=key)
+        if not run_file_list:
+            for item in item_list:
+                yield item
+            return
+        run_list = [_iterRun(x) for x in run_file_list]
+        run_list.append(item_list)
+        for _, _, item in heapq.merge(*[
+                    _decorateRun(run, key, run_number)
+                    for run_number, run in enumerate(run_list)
+                ]):
+            yield item
+    finally:
+        for run_file in run_file_list:
+            run_file.close()
+
+def _sumMerge(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return a + b
+
+def _minMerge(a, b):
+    if a is None or (b is not None and b < a):
+        return b
+    return a
+
+def _maxMerge(a, b):
+    if a is None or (b is not None and b > a):
+        return b
+    return a
+
+def _avgStep(state, value):
+    return state[0] + value, state[1] + 1
+
+def _avgMerge(a, b):
+    return a[0] + b[0], a[1] + b[1]
+
+def _avgFinal(state):
+    total, count = state
+    if count:
+        return total / float(count)
+    return None
+
+def _identity(value):
+    return value
+
+# Aggregate functions: name -> (initial state, step(state, value),
+# merge(state, state), final(state)).
+# Like in SQL, NULL values are ignored, and sum, min, max and avg of no
+# value are None.
+_aggregate_dict = {
+    'count': (0, lambda state, value: state + 1, operator.add, _identity),
+    'sum': (None, _sumMerge, _sumMerge, _identity),
+    'min': (None, _minMerge, _minMerge, _identity),
+    'max': (None, _maxMerge, _maxMerge, _identity),
+    'avg': ((0, 0), _avgStep, _avgMerge, _avgFinal),
+}
+
+class _ReversedKey(object):
+    __slots__ = ('_key', )
+
+    def __init__(self, key):
+        self._key = key
+
+    def __lt__(self, other):
+        return other._key < self._key
+
+    def __eq__(self, other):
+        return self._key == other._key
+
+def sort_rows(row_iterable, position_list, reverse=False,
+        max_rows_in_memory=100000, tmp_dir=None):
+    """
+    Iterate over rows from row_iterable (ex: BaseCursor.iterRows, range or
+    iterPrefix), sorted on columns at given positions.
+    See external_sort for memory usage.
+    """
+    position_list = tuple(position_list)
+    if reverse:
+        def key(row):
+            return _ReversedKey(tuple([row[x] for x in position_list]))
+    else:
+        def key(row):
+            return tuple([row[x] for x in position_list])
+    return external_sort(row_iterable, key, max_rows_in_memory, tmp_dir)
+
+_GROUP_SPILL_FANOUT = 16
+_GROUP_SPILL_MAX_DEPTH = 4
+
+def _spillGroups(group_dict, partition_file_list, depth, tmp_dir):
+    """
+    Append (key, state_list) pairs from group_dict to partition files,
+    partitioned on key hash.
+    """
+    if partition_file_list is None:
+        partition_file_list = [tempfile.TemporaryFile(dir=tmp_dir)
+            for _ in xrange(_GROUP_SPILL_FANOUT)]
+    dump_list = [cPickle.Pickler(x, cPickle.HIGHEST_PROTOCOL).dump
+        for x in partition_file_list]
+    for item in group_dict.iteritems():
+        dump_list[hash((depth, item[0])) % _GROUP_SPILL_FANOUT](item)
+    return partition_file_list
+
+def _iterMergedGroups(partition_file_list, merge_list, max_groups_in_memory,
+        tmp_dir, depth):
+    """
+    Iterate over (key, state_list) pairs from spilled partitions, merging
+    partial states of a same group.
+    """
+    for partition_file in partition_file_list:
+        partition_file.seek(0)
+        group_dict = {}
+        sub_partition_file_list = None
+        for key, state_list in _iterRun(partition_file):
+            try:
+                current_state_list = group_dict[key]
+            except KeyError:
+                group_dict[key] = state_list
+            else:
+                group_dict[key] = [merge(a, b) for merge, a, b in zip(
+                    merge_list, current_state_list, state_list)]
+                continue
+            if len(group_dict) > max_groups_in_memory and \
+                    depth < _GROUP_SPILL_MAX_DEPTH:
+                sub_partition_file_list = _spillGroups(group_dict,
+                    sub_partition_file_list, depth + 1, tmp_dir)
+                group_dict = {}
+        partition_file.close()
+        if sub_partition_file_list is None:
+            for item in group_dict.iteritems():
+                yield item
+        else:
+            _spillGroups(group_dict, sub_partition_file_list, depth + 1,
+                tmp_dir)
+            for item in _iterMergedGroups(sub_partition_file_list,
+                    merge_list, max_groups_in_memory, tmp_dir, depth + 1):
+                yield item
+
+def hash_aggregate(row_iterable, group_position_list, aggregate_list,
+        max_groups_in_memory=100000, tmp_dir=None):
+    """
+    Group rows from row_iterable (ex: BaseCursor.iterRows, range or
+    iterPrefix) on columns at group_position_list, and compute aggregates
+    for each group.
+
+    aggregate_list items are (name, position) pairs, see
+    BaseCursor.aggregate.
+    Produces one row per group: group column values followed by aggregate
+    values, in no particular order (see sort_rows).
+    When more than max_groups_in_memory groups are in memory, partial
+    states are written to temporary files in tmp_dir, partitioned on group
+    hash, and merged once input is exhausted.
+    """
+    group_position_list = tuple(group_position_list)
+    step_list = []
+    merge_list = []
+    final_list = []
+    initial_list = []
+    for name, position in aggregate_list:
+        if position is None and name != 'count':
+            raise ValueError('position is required for %r' % (name, ))
+        initial, step, merge, final = _aggregate_dict[name]
+        initial_list.append(initial)
+        step_list.append((position, step))
+        merge_list.append(merge)
+        final_list.append(final)
+    step_list = list(enumerate(step_list))
+    group_dict = {}
+    partition_file_list = None
+    try:
+        for row in row_iterable:
+            key = tuple([row[x] for x in group_position_list])
+            try:
+                state_list = group_dict[key]
+            except KeyError:
+                if len(group_dict) >= max_groups_in_memory:
+                    partition_file_list = _spillGroups(group_dict,
+                        partition_file_list, 0, tmp_dir)
+                    group_dict = {}
+                state_list = group_dict[key] = list(initial_list)
+            for index, (position, step) in step_list:
+                if position is None:
+                    value = True
+                else:
+                    value = row[position]
+                    if value is None:
+                        continue
+                state_list[index] = step(state_list[index], value)
+        if partition_file_list is None:
+            group_iterator = group_dict.iteritems()
+        else:
+            _spillGroups(group_dict, partition_file_list, 0, tmp_dir)
+            group_dict = None
+            group_iterator = _iterMergedGroups(partition_file_list,
+                merge_list, max_groups_in_memory, tmp_dir, 0)
+        for key, state_list in group_iterator:
+            yield key + tuple([final(state)
+                for final, state in zip(final_list, state_list)])
+    finally:
+        if partition_file_list is not None:
+            for partition_file in partition_file_list:
+                partition_file.close()
+
+_predicate_operator_dict = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+_predicate_operator_set = frozenset(_predicate_operator_dict).union((
+    'in', 'prefix', 'is null', 'is not null'))
+
+def namedtuple_row_factory(typename, field_names):
+    """
+    Return a row factory producing namedtuple instances.
+    See BaseCursor.setRowFactory .
+    """
+    return namedtuple(typename, field_names)._make
+
+def dict_row_factory(field_names):
+    """
+    Return a row factory producing dicts, keyed by given column names.
+    See BaseCursor.setRowFactory .
+    """
+    field_names = tuple(field_names)
+    def factory(values):
+        return dict(zip(field_names, values))
+    return factory
+
 class BaseCursor(object):
     _cursor = None
+    _layout_dict = None
+    _row_factory = None
+    _fetch_state = None
+    _fetch_exhausted = False
+    _projection = None
+    _key_position_list = None
+    _match_mode = libinnodb.IB_CLOSEST_MATCH
+    _lock_mode = libinnodb.IB_LOCK_NONE
+    _column_name_list = None
+    _value_codec_dict = None
+    _cache_key = None
+    _tuple_pool_dict = None
+    _tuple_pool_epoch = 0
+    _tuple_pool_size = 4
 
     def __init__(self):
         raise NotImplementedError()
 
+    def _newTuple(self, tuple_class):
+        """
+        Create a tuple sharing the column layout already known for its class.
+
+        Layout is only computed for the first tuple of each class, and
+        recomputed if table column count changed since.
+        """
+        layout_dict = self._layout_dict
+        if layout_dict is None:
+            self._layout_dict = layout_dict = {}
+        layout = layout_dict.get(tuple_class)
+        tpl = tuple_class(self._cursor, layout)
+        if tpl._layout is not layout:
+            if self._value_codec_dict and tuple_class is ClusterReadTuple:
+                tpl._setLayout(ColumnLayout(tpl._tuple,
+                    self._value_codec_dict))
+            layout_dict[tuple_class] = tpl._layout
+        return tpl
+
+    def setColumnCodecDict(self, codec_dict):
+        """
+        Set value codecs (see ZlibColumnCodec), by table column position, to
+        apply to table row values.
+        Only rows read and written through table read tuples (ClusterReadTuple)
+        are transformed. Raw accessors (getBuffer, readinto, getBlobReader...)
+        see stored values. Predicates (see _compileWhere) compare stored
+        values with encoded predicate values, so only equality operators are
+        allowed on codec columns.
+        Usually set from table registry, see Table.setColumnCodecDict .
+        """
+        self._value_codec_dict = dict(codec_dict)
+        self.clearLayoutCache()
+
+    def setKeyPositionList(self, position_list):
+        """
+        Tell which read tuple column holds each key column, in key order.
+
+        Only needed when key columns are not the first columns of read
+        tuples (ex: TableCursor on a table with key columns not declared
+        first - see TableSchema.getKeyPositionList).
+        """
+        self._key_position_list = tuple(position_list)
+
+    def getKeyPositionList(self):
+        result = self._key_position_list
+        if result is None:
+            self._key_position_list = result = tuple(xrange(len(
+                self.getSearchTuple())))
+        return result
+
+    def clearLayoutCache(self):
+        """
+        Forget column layouts, so they get recomputed on next tuple creation.
+
+        Only needed if table schema changed without changing its column count.
+        """
+        self._layout_dict = None
+        # Pooled and cached tuples have the old layout.
+        self._tuple_pool_dict = None
+        self._tuple_pool_epoch += 1
+        self._fetch_state = None
+
     def getReadTuple(self):
         raise NotImplementedError()
 
     def getSearchTuple(self):
         raise NotImplementedError()
 
+    def setTuplePoolSize(self, size):
+        """
+        Set how many released tuples of each kind are kept for reuse.
+        See acquireReadTuple .
+        """
+        self._tuple_pool_size = size
+        for tuple_list in (self._tuple_pool_dict or {}).itervalues():
+            del tuple_list[size:]
+
+    def _acquireTuple(self, kind, new_tuple):
+        tuple_pool_dict = self._tuple_pool_dict
+        if tuple_pool_dict is None:
+            self._tuple_pool_dict = tuple_pool_dict = {}
+        tuple_list = tuple_pool_dict.get(kind)
+        if tuple_list:
+            tpl = tuple_list.pop()
+            tpl._released = False
+            return tpl
+        tpl = new_tuple()
+        tpl._pool_key = (kind, self._tuple_pool_epoch)
+        return tpl
+
+    def acquireReadTuple(self):
+        """
+        Return an empty read tuple from cursor's tuple pool, creating one if
+        pool is empty.
+        Give it back with releaseTuple once done, so next acquisition does
+        not have to allocate a tuple.
+        """
+        return self._acquireTuple('read', self.getReadTuple)
+
+    def acquireSearchTuple(self):
+        """
+        Search tuple version of acquireReadTuple.
+        """
+        return self._acquireTuple('search', self.getSearchTuple)
+
+    def releaseTuple(self, tpl):
+        """
+        Clear tpl and put it back in tuple pool, or free it if pool is full.
+        tpl must not be used by caller anymore.
+        """
+        if tpl._pool_key is None:
+            raise ValueError('Tuple does not come from a tuple pool')
+        if tpl._released:
+            raise ValueError('Tuple already released')
+        tpl._released = True
+        kind, epoch = tpl._pool_key
+        if epoch != self._tuple_pool_epoch:
+            return
+        tuple_list = self._tuple_pool_dict.setdefault(kind, [])
+        if len(tuple_list) < self._tuple_pool_size:
+            tpl.clear()
+            tuple_list.append(tpl)
+
+    @contextlib.contextmanager
+    def pooledReadTuple(self):
+        """
+        Context manager version of acquireReadTuple and releaseTuple.
+        """
+        tpl = self.acquireReadTuple()
+        try:
+            yield tpl
+        finally:
+            self.releaseTuple(tpl)
+
+    @contextlib.contextmanager
+    def pooledSearchTuple(self):
+        """
+        Context manager version of acquireSearchTuple and releaseTuple.
+        """
+        tpl = self.acquireSearchTuple()
+        try:
+            yield tpl
+        finally:
+            self.releaseTuple(tpl)
+
     def lockTable(self, mode):
         cursor_lock(self._cursor, mode)
 
     def setLockMode(self, mode):
         cursor_set_lock_mode(self._cursor, mode)
+        self._lock_mode = mode
+
+    def getLockMode(self):
+        return self._lock_mode
 
     def read(self, tpl):
+        tpl._generation += 1
         cursor_read_row(self._cursor, tpl._tuple)
-        tpl._update()
 
     def goFirst(self):
+        self._fetch_exhausted = False
         cursor_first(self._cursor)
 
     def goNext(self):
+        self._fetch_exhausted = False
         cursor_next(self._cursor)
 
     def goPrev(self):
+        self._fetch_exhausted = False
         cursor_prev(self._cursor)
 
     def goLast(self):
+        self._fetch_exhausted = False
         cursor_last(self._cursor)
 
     def goTo(self, tpl, search_mode=libinnodb.IB_CUR_GE):
+        self._fetch_exhausted = False
         res = ctypes.c_int()
         cursor_moveto(self._cursor, tpl._tuple, search_mode, ctypes.byref(res))
         return res.value
 
+    # try* methods return DB_SUCCESS, DB_END_OF_INDEX or DB_RECORD_NOT_FOUND
+    # and raise on any other error.
+
+    def tryRead(self, tpl):
+        tpl._generation += 1
+        return try_cursor_read_row(self._cursor, tpl._tuple)
+
+    def tryFirst(self):
+        self._fetch_exhausted = False
+        return try_cursor_first(self._cursor)
+
+    def tryNext(self):
+        self._fetch_exhausted = False
+        return try_cursor_next(self._cursor)
+
+    def tryPrev(self):
+        self._fetch_exhausted = False
+        return try_cursor_prev(self._cursor)
+
+    def tryLast(self):
+        self._fetch_exhausted = False
+        return try_cursor_last(self._cursor)
+
+    def tryGoTo(self, tpl, search_mode=libinnodb.IB_CUR_GE):
+        self._fetch_exhausted = False
+        res = ctypes.c_int()
+        return try_cursor_moveto(self._cursor, tpl._tuple, search_mode,
+            ctypes.byref(res))
+
     def _iter(self, tpl, go):
-        while True:
-            try:
-                self.read(tpl)
-            except InnoDBError, exc:
-                if exc.getErrorCode() in (
-                            libinnodb.DB_END_OF_INDEX,
-                            libinnodb.DB_RECORD_NOT_FOUND,
-                        ):
-                    break
-                raise
+        read = self.tryRead
+        while read(tpl) == DB_SUCCESS:
             yield tpl
             tpl.clear()
-            try:
-                go()
-            except InnoDBError, exc:
-                if exc.getErrorCode() in (
-                            libinnodb.DB_END_OF_INDEX,
-                            libinnodb.DB_RECORD_NOT_FOUND,
-                        ):
-                    break
-                raise
+            if go() != DB_SUCCESS:
+                break
 
     def iterForward(self):
-        return self._iter(self.getReadTuple(), self.goNext)
+        return self._iter(self.getReadTuple(), self.tryNext)
 
     def iterBackward(self):
-        return self._iter(self.getReadTuple(), self.goPrev)
+        return self._iter(self.getReadTuple(), self.tryPrev)
+
+    def setRowFactory(self, factory):
+        """
+        Choose the type of rows returned by fetch* and iterRows.
+
+        factory receives a tuple of column values and returns the row.
+        None (default) returns the tuple itself.
+        See namedtuple_row_factory and dict_row_factory.
+        """
+        self._row_factory = factory
+
+    def setProjection(self, position_list):
+        """
+        Only return given table columns (positions in table rows) in rows
+        produced by fetch*, iterRows, range and iterPrefix. Other columns
+        are not decoded.
+        Table cursor read tuples hold table columns in table order, so these
+        are also read tuple positions for them. See IndexCursor.setProjection
+        for index cursors.
+        None (default) returns all read tuple columns.
+        """
+        if position_list is not None:
+            position_list = tuple(position_list)
+        self._projection = position_list
+        self._fetch_state = None
+
+    def _getRowDecoder(self, tpl):
+        """
+        Return a function decoding the row tpl was read in, according to
+        current projection.
+        """
+        projection = self._projection
+        if projection is None:
+            return tpl.getRow
+        reader = tpl._codec.getReader(projection)
+        return lambda: reader(tpl._tuple)
+
+    def _fetch(self, tpl, decode, go):
+        """
+        Decode the row at current position, then move cursor with go (one of
+        the try* methods).
+        Returns None if cursor is not on a row, or if a previous call already
+        moved it past the last row (until cursor is positioned again).
+        """
+        if self._fetch_exhausted or self.tryRead(tpl) != DB_SUCCESS:
+            return None
+        row = decode()
+        tpl.clear()
+        if go() != DB_SUCCESS:
+            self._fetch_exhausted = True
+        factory = self._row_factory
+        if factory is not None:
+            row = factory(row)
+        return row
+
+    def _getFetchState(self):
+        state = self._fetch_state
+        if state is None:
+            tpl = self.getReadTuple()
+            self._fetch_state = state = (tpl, self._getRowDecoder(tpl))
+        return state
+
+    def fetchone(self):
+        """
+        Return the row at current cursor position and move to next row.
+        Returns None when there is no more row.
+        """
+        tpl, decode = self._getFetchState()
+        return self._fetch(tpl, decode, self.tryNext)
+
+    def fetchmany(self, size):
+        """
+        Return a list of up to size rows, starting at current position.
+        """
+        fetch = self._fetch
+        tpl, decode = self._getFetchState()
+        go = self.tryNext
+        result = []
+        append = result.append
+        for _ in xrange(size):
+            row = fetch(tpl, decode, go)
+            if row is None:
+                break
+            append(row)
+        return result
+
+    def fetchall(self):
+        """
+        Return a list of all rows from current position to the end of index.
+        """
+        return list(self.iterRows())
+
+    def setColumnNameList(self, name_list):
+        """
+        Name read tuple columns, so predicates can refer to them by name.
+        See TableSchema.getColumnNameList .
+        """
+        self._column_name_list = list(name_list)
+
+    def _compileWhere(self, where, tpl):
+        """
+        Compile predicate list where into a function telling whether the row
+        read in given raw tuple matches all predicates, checking stored
+        column bytes so non-matching rows are never decoded.
+        Returns None if where is empty.
+
+        Predicates are (column, operator[, value]) tuples, column being a
+        name (see setColumnNameList) or a position in read tuple, and
+        operator one of:
+          '=', '!=', '<', '<=', '>', '>=': compare with value (stored bytes,
+            so binary collation for strings)
+          'in': value is a sequence of values
+          'prefix': string column starts with value
+          'is null', 'is not null': no value
+        As in SQL, NULL only matches 'is null'.
+        Values are encoded like stored values, including value codecs (see
+        setColumnCodecDict): on codec columns, only '=', '!=', 'in' and null
+        tests are allowed, as encoded values do not preserve ordering.
+        """
+        if not where:
+            return None
+        check_list = [self._compilePredicate(tpl, *x) for x in where]
+        if len(check_list) == 1:
+            return check_list[0]
+        def check(raw_tuple):
+            for predicate in check_list:
+                if not predicate(raw_tuple):
+                    return False
+            return True
+        return check
+
+    def _compilePredicate(self, tpl, column, op, value=None):
+        if op not in _predicate_operator_set:
+            raise ValueError('Unknown predicate operator: %r' % (op, ))
+        if not isinstance(column, (int, long)):
+            if self._column_name_list is None:
+                raise ValueError('No column names, see setColumnNameList')
+            column = self._column_name_list.index(column)
+        index, col_type = tpl._column_list[column][:2]
+        if op not in ('=', '!=', 'in', 'is null', 'is not null') and \
+                isinstance(tpl, ClusterReadTuple) and \
+                column in (self._value_codec_dict or ()):
+            raise ValueError('%r not supported on codec column %r' % (op,
+                column))
+        get_len = col_get_len
+        null = libinnodb.IB_SQL_NULL
+        if op == 'is null':
+            return lambda raw_tuple: get_len(raw_tuple, index) == null
+        if op == 'is not null':
+            return lambda raw_tuple: get_len(raw_tuple, index) != null
+        string_at = ctypes.string_at
+        get_value = libinnodb.ib_col_get_value
+        if op == 'prefix':
+            if col_type not in _string_type_set:
+                raise ValueError('prefix on non-string column %r' % (
+                    column, ))
+            def check(raw_tuple):
+                data_len = get_len(raw_tuple, index)
+                return data_len != null and data_len >= len(value) and \
+                    string_at(get_value(raw_tuple, index),
+                        len(value)) == value
+            return check
+        # Encode value(s) the way they are stored, by writing them in a
+        # scratch tuple.
+        scratch = self.getReadTuple()
+        key_reader = scratch._codec.getKeyReader((column, ))
+        def encode(value):
+            scratch[column] = value
+            result, = key_reader(scratch._tuple)
+            scratch.clear()
+            return result
+        if op == 'in':
+            expected_set = frozenset(encode(x) for x in value)
+            column_reader = tpl._codec.getKeyReader((column, ))
+            def check(raw_tuple):
+                column_value, = column_reader(raw_tuple)
+                return column_value is not None and \
+                    column_value in expected_set
+            return check
+        expected = encode(value)
+        if op == '=' and isinstance(expected, str):
+            expected_len = len(expected)
+            def check(raw_tuple):
+                data_len = get_len(raw_tuple, index)
+                return data_len == expected_len and string_at(
+                    get_value(raw_tuple, index), data_len) == expected
+            return check
+        compare = _predicate_operator_dict[op]
+        column_reader = tpl._codec.getKeyReader((column, ))
+        def check(raw_tuple):
+            column_value, = column_reader(raw_tuple)
+            return column_value is not None and compare(column_value,
+                expected)
+        return check
+
+    def iterRows(self, reverse=False, where=None):
+        """
+        Iterate over decoded rows, starting at current position.
+
+        Unlike iterForward/iterBackward, yielded rows are independent from
+        the cursor and remain valid after it moved.
+        Rows not matching where predicates (see _compileWhere) are skipped
+        without being decoded.
+        """
+        if reverse:
+            go = self.tryPrev
+        else:
+            go = self.tryNext
+        tpl = self.getReadTuple()
+        if where:
+            check = self._compileWhere(where, tpl)
+            read = self.tryRead
+            decode = self._getRowDecoder(tpl)
+            factory = self._row_factory
+            while read(tpl) == DB_SUCCESS:
+                if check(tpl._tuple):
+                    row = decode()
+                    if factory is not None:
+                        row = factory(row)
+                    yield row
+                tpl.clear()
+                if go() != DB_SUCCESS:
+                    break
+            return
+        fetch = self._fetch
+        decode = self._getRowDecoder(tpl)
+        while True:
+            row = fetch(tpl, decode, go)
+            if row is None:
+                break
+            yield row
+
+    def getLazyRow(self, tpl):
+        """
+        Return a LazyRow reading from given read tuple.
+        Row is only valid as long as tpl content does not change, see
+        LazyRow.detach .
+        """
+        return LazyRow(tpl, self.getReadTuple)
+
+    def iterLazyRows(self, reverse=False, where=None):
+        """
+        Iterate over LazyRow instances, starting at current position.
+
+        Columns are only decoded when accessed. All yielded rows share the
+        same tuple: a row must be detached (see LazyRow.detach) before next
+        iteration to access its not-yet-decoded columns afterwards.
+        Rows not matching where predicates (see _compileWhere) are skipped.
+        Projection and row factory are ignored, rows expose all read tuple
+        columns.
+        """
+        if reverse:
+            go = self.tryPrev
+        else:
+            go = self.tryNext
+        read = self.tryRead
+        tpl = self.getReadTuple()
+        check = self._compileWhere(where, tpl)
+        new_tuple = self.getReadTuple
+        while read(tpl) == DB_SUCCESS:
+            if check is None or check(tpl._tuple):
+                row = LazyRow(tpl, new_tuple)
+                yield row
+                row._invalidate(tpl)
+            tpl.clear()
+            if go() != DB_SUCCESS:
+                break
+
+    def _iterRangeTuple(self, tpl, low, high, low_inclusive, high_inclusive,
+            reverse):
+        """
+        Position tpl on each row whose key is between low and high, and yield
+        it. See range.
+        tpl content is only valid until next iteration, during which cursor
+        is positioned on the yielded row.
+        """
+        reverse = bool(reverse)
+        if reverse:
+            start, start_inclusive, stop, stop_inclusive = (high,
+                high_inclusive, low, low_inclusive)
+            go_start = self.tryLast
+            go = self.tryPrev
+            search_mode = start_inclusive and libinnodb.IB_CUR_LE or \
+                libinnodb.IB_CUR_L
+        else:
+            start, start_inclusive, stop, stop_inclusive = (low,
+                low_inclusive, high, high_inclusive)
+            go_start = self.tryFirst
+            go = self.tryNext
+            search_mode = start_inclusive and libinnodb.IB_CUR_GE or \
+                libinnodb.IB_CUR_G
+        if stop is None:
+            key_reader = None
+        else:
+            with self.pooledSearchTuple() as search_tuple:
+                search_tuple.setRow(stop)
+                stop_key = search_tuple._codec.getKeyReader(
+                    xrange(len(stop)))(search_tuple._tuple)
+            key_reader = tpl._codec.getKeyReader(
+                self.getKeyPositionList()[:len(stop)])
+        start_tuple = None
+        try:
+            if start is None:
+                res = go_start()
+            else:
+                # Keep search tuple alive during iteration: cursor may refer
+                # to its fields when moving, depending on match mode.
+                start_tuple = self.acquireSearchTuple()
+                start_tuple.setRow(start)
+                res = self.tryGoTo(start_tuple, search_mode)
+            if res != DB_SUCCESS:
+                return
+            read = self.tryRead
+            while read(tpl) == DB_SUCCESS:
+                if key_reader is not None:
+                    key = key_reader(tpl._tuple)
+                    if key == stop_key:
+                        if not stop_inclusive:
+                            break
+                    elif (key < stop_key) == reverse:
+                        break
+                yield tpl
+                tpl.clear()
+                if go() != DB_SUCCESS:
+                    break
+        finally:
+            if start_tuple is not None:
+                self.releaseTuple(start_tuple)
+
+    def range(self, low=None, high=None, low_inclusive=True,
+            high_inclusive=False, reverse=False, where=None):
+        """
+        Iterate over rows whose key is between low and high.
+
+        low and high are sequences of key column values, possibly only the
+        first ones of the key, in which case rows are compared on that many
+        key columns. None means unbounded.
+        Cursor is positioned with the matching search mode, then rows are
+        checked against the other bound by comparing stored key bytes, so
+        rows past the bound are not decoded.
+        Rows are produced in key order, or reverse key order if reverse is
+        true.
+        Rows not matching where predicates (see _compileWhere) are skipped
+        without being decoded.
+        """
+        read_tuple = self.acquireReadTuple()
+        try:
+            decode = self._getRowDecoder(read_tuple)
+            check = self._compileWhere(where, read_tuple)
+            factory = self._row_factory
+            for tpl in self._iterRangeTuple(read_tuple, low, high,
+                    low_inclusive, high_inclusive, reverse):
+                if check is not None and not check(tpl._tuple):
+                    continue
+                row = decode()
+                if factory is not None:
+                    row = factory(row)
+                yield row
+        finally:
+            self.releaseTuple(read_tuple)
+
+    def _aggregateState(self, name, position, low, high, low_inclusive,
+            high_inclusive):
+        """
+        Return the partial state of aggregate function name over column at
+        position, for rows in given key range. See aggregate.
+        """
+        read_tuple = self.acquireReadTuple()
+        try:
+            return self._aggregateTupleState(read_tuple, name, position, low,
+                high, low_inclusive, high_inclusive)
+        finally:
+            self.releaseTuple(read_tuple)
+
+    def _aggregateTupleState(self, tpl, name, position, low, high,
+            low_inclusive, high_inclusive):
+        initial, step, _, _ = _aggregate_dict[name]
+        if name in ('min', 'max') and position is not None and \
+                position == self.getKeyPositionList()[0]:
+            # Rows come in column order: first non-NULL value is the answer.
+            # NULL values sort first, so they are only skipped for min.
+            reverse = name == 'max'
+            reader = tpl._codec.getReader((position, ))
+            for tpl in self._iterRangeTuple(tpl, low, high, low_inclusive,
+                    high_inclusive, reverse):
+                value, = reader(tpl._tuple)
+                if value is not None:
+                    return value
+            return initial
+        state = initial
+        tuple_iterator = self._iterRangeTuple(tpl, low, high, low_inclusive,
+            high_inclusive, False)
+        if position is None:
+            for tpl in tuple_iterator:
+                state = step(state, True)
+            return state
+        index, reader = tpl._codec.reader_list[position]
+        get_len = col_get_len
+        null = libinnodb.IB_SQL_NULL
+        for tpl in tuple_iterator:
+            raw_tuple = tpl._tuple
+            data_len = get_len(raw_tuple, index)
+            if data_len != null:
+                state = step(state, reader(raw_tuple, data_len))
+        return state
+
+    def aggregate(self, name, position=None, low=None, high=None,
+            low_inclusive=True, high_inclusive=False):
+        """
+        Compute an aggregate over a column, without decoding other columns.
+
+        name is one of 'count', 'sum', 'min', 'max' and 'avg'.
+        position is the column position in read tuple. It may only be None
+        for 'count', to count rows instead of non-NULL values.
+        low, high, low_inclusive and high_inclusive restrict rows to a key
+        range, see range.
+        min and max of the leading key column only read the first row found
+        from the appropriate end of the range.
+        """
+        if position is None and name != 'count':
+            raise ValueError('position is required for %r' % (name, ))
+        return _aggregate_dict[name][3](self._aggregateState(name, position,
+            low, high, low_inclusive, high_inclusive))
+
+    def _iterPrefixTuple(self, prefix, tpl):
+        """
+        Position tpl on each row whose first len(prefix) key columns are
+        equal to prefix values, and yield it.
+        tpl content is only valid until next iteration.
+        """
+        search_tuple = self.acquireSearchTuple()
+        previous_match_mode = self._match_mode
+        try:
+            search_tuple.setRow(prefix)
+            prefix_key = search_tuple._codec.getKeyReader(
+                xrange(len(prefix)))(search_tuple._tuple)
+            key_reader = tpl._codec.getKeyReader(
+                self.getKeyPositionList()[:len(prefix)])
+            self.setMatchMode(libinnodb.IB_EXACT_PREFIX)
+            if self.tryGoTo(search_tuple, libinnodb.IB_CUR_GE) != DB_SUCCESS:
+                return
+            read = self.tryRead
+            go = self.tryNext
+            while read(tpl) == DB_SUCCESS:
+                if key_reader(tpl._tuple) != prefix_key:
+                    break
+                yield tpl
+                tpl.clear()
+                if go() != DB_SUCCESS:
+                    break
+        finally:
+            self.setMatchMode(previous_match_mode)
+            self.releaseTuple(search_tuple)
+
+    def iterPrefix(self, prefix, where=None):
+        """
+        Iterate over rows whose first len(prefix) key columns are equal to
+        prefix values, in key order.
+
+        Uses IB_EXACT_PREFIX match mode, previous match mode is restored when
+        iteration ends.
+        Rows not matching where predicates (see _compileWhere) are skipped
+        without being decoded.
+        """
+        factory = self._row_factory
+        read_tuple = self.acquireReadTuple()
+        try:
+            decode = self._getRowDecoder(read_tuple)
+            check = self._compileWhere(where, read_tuple)
+            for tpl in self._iterPrefixTuple(prefix, read_tuple):
+                if check is not None and not check(tpl._tuple):
+                    continue
+                row = decode()
+                if factory is not None:
+                    row = factory(row)
+                yield row
+        finally:
+            self.releaseTuple(read_tuple)
+
+    def _iterPartition(self, low, high):
+        """
+        Iterate over rows whose leading key column value is in [low, high).
+        None means unbounded.
+        """
+        if low is not None:
+            low = (low, )
+        if high is not None:
+            high = (high, )
+        return self.range(low, high)
 
     def isPositioned(self):
         return bool(cursor_is_positioned(self._cursor))
 
     def reset(self):
+        self._fetch_exhausted = False
         cursor_reset(self._cursor)
 
+    def attachTransaction(self, transaction):
+        """
+        Make cursor work within given (begun) transaction.
+        Cursor must have been reset before its previous transaction ended.
+        """
+        libinnodb.ib_cursor_attach_trx(self._cursor, transaction._txn_id)
+        self._transaction = transaction
+
+    def _commitAndContinue(self):
+        """
+        Commit cursor's transaction, begin it again and reattach cursor.
+        Cursor position and locks are lost.
+        """
+        transaction = self._transaction
+        self.reset()
+        transaction.commit()
+        transaction.begin()
+        self.attachTransaction(transaction)
+
     def close(self):
         cursor_close(self._cursor)
         del self._cursor
 
     def setMatchMode(self, mode):
         cursor_set_match_mode(self._cursor, mode)
+        self._match_mode = mode
+
+    def getMatchMode(self):
+        return self._match_mode
 
     def _setSimpleSelect(self):
         libinnodb.ib_cursor_set_simple_select(self._cursor)
@@ -613,18 +1961,27 @@ class BaseCursor(object):
             self.close()
 
 class TableCursor(BaseCursor):
+    _lookup_state = None
+    _upsert_state = None
+
     def __init__(self, table, transaction, read_only=False):
         self._cursor = cursor = libinnodb.ib_crsr_t()
         cursor_open_table(table, transaction._txn_id,
             ctypes.byref(cursor))
+        self._transaction = transaction
         if read_only:
             self._setSimpleSelect()
 
+    def clearLayoutCache(self):
+        super(TableCursor, self).clearLayoutCache()
+        self._lookup_state = None
+        self._upsert_state = None
+
     def getReadTuple(self):
-        return ClusterReadTuple(self._cursor)
+        return self._newTuple(ClusterReadTuple)
 
     def getSearchTuple(self):
-        return ClusterSearchTuple(self._cursor)
+        return self._newTuple(ClusterSearchTuple)
 
     def insert(self, tpl):
         cursor_insert_row(self._cursor, tpl._tuple)
@@ -632,14 +1989,205 @@ class TableCursor(BaseCursor):
     def insertRows(self, row_list):
         tpl = self.getReadTuple()
         for row in row_list:
-            for column_number, value in enumerate(row):
-                tpl[column_number] = value
+            tpl.setRow(row)
             self.insert(tpl)
             tpl.clear()
 
+    def bulkLoad(self, row_iterable, batch_size=10000,
+            lock_mode=libinnodb.IB_LOCK_IX, progress=None, sort_key=None,
+            max_rows_in_memory=100000, tmp_dir=None):
+        """
+        Insert many rows, committing every batch_size rows.
+
+        If sort_key is given, rows are first sorted with it (see
+        external_sort for max_rows_in_memory and tmp_dir), so they get
+        inserted in clustered index order, avoiding random page splits.
+        See TableSchema.getKeyFunction for a suitable sort_key.
+
+        Table is locked in lock_mode (IB_LOCK_IX or IB_LOCK_X) once per
+        transaction. After each batch, cursor's transaction is committed and
+        begun again, so it is left begun on return, with all loaded rows
+        committed. If batch_size is None, nothing is committed.
+        progress, if given, is called after each commit with the number of
+        rows inserted so far and the average rows per second.
+        Returns the number of inserted rows.
+        """
+        if sort_key is not None:
+            row_iterable = external_sort(row_iterable, sort_key,
+                max_rows_in_memory, tmp_dir)
+        tpl = self.getReadTuple()
+        set_row = tpl.setRow
+        clear = tpl.clear
+        insert = libinnodb.ib_cursor_insert_row
+        cursor = self._cursor
+        self.lockTable(lock_mode)
+        start = time.time()
+        row_count = 0
+        batch_count = 0
+        for row in row_iterable:
+            set_row(row)
+            res = insert(cursor, tpl._tuple).value
+            if res != DB_SUCCESS:
+                raise InnoDBError(res)
+            clear()
+            row_count += 1
+            batch_count += 1
+            if batch_count == batch_size:
+                batch_count = 0
+                self._commitAndContinue()
+                self.lockTable(lock_mode)
+                if progress is not None:
+                    progress(row_count, row_count / max(time.time() - start,
+                        1e-6))
+        if batch_size is not None and batch_count:
+            self._commitAndContinue()
+            if progress is not None:
+                progress(row_count, row_count / max(time.time() - start,
+                    1e-6))
+        return row_count
+
     def update(self, old, new):
         cursor_update_row(self._cursor, old._tuple, new._tuple)
 
+    def _modifyRange(self, low, high, low_inclusive, high_inclusive,
+            commit_every, modify):
+        """
+        Call modify(tpl) for each row in given key range, tpl being read with
+        an exclusive lock.
+        If commit_every is not None, commit cursor's transaction (and begin
+        it again) after this many calls.
+        Returns the number of calls for which modify returned true.
+        """
+        tpl = self.getReadTuple()
+        key_reader = tpl._codec.getReader(self.getKeyPositionList())
+        count = 0
+        previous_lock_mode = self._lock_mode
+        try:
+            while True:
+                self.lockTable(libinnodb.IB_LOCK_IX)
+                self.setLockMode(libinnodb.IB_LOCK_X)
+                chunk_count = 0
+                last_key = None
+                tuple_iterator = self._iterRangeTuple(tpl, low, high,
+                    low_inclusive, high_inclusive, False)
+                for tpl in tuple_iterator:
+                    if modify(tpl):
+                        count += 1
+                    chunk_count += 1
+                    if chunk_count == commit_every:
+                        last_key = key_reader(tpl._tuple)
+                        break
+                tuple_iterator.close()
+                tpl.clear()
+                if commit_every is not None:
+                    self._commitAndContinue()
+                if last_key is None:
+                    break
+                low = last_key
+                low_inclusive = False
+        finally:
+            self.setLockMode(previous_lock_mode)
+        return count
+
+    def deleteRange(self, low=None, high=None, low_inclusive=True,
+            high_inclusive=False, commit_every=None):
+        """
+        Delete rows whose key is between low and high (see range).
+
+        Rows are locked in exclusive mode while walking the range once.
+        If commit_every is not None, cursor's transaction is committed (and
+        begun again) after this many rows, bounding undo log size.
+        Returns the number of deleted rows.
+        """
+        delete = libinnodb.ib_cursor_delete_row
+        cursor = self._cursor
+        def modify(tpl):
+            res = delete(cursor).value
+            if res != DB_SUCCESS:
+                raise InnoDBError(res)
+            return True
+        return self._modifyRange(low, high, low_inclusive, high_inclusive,
+            commit_every, modify)
+
+    def updateRange(self, low, high, function, low_inclusive=True,
+            high_inclusive=False, commit_every=None):
+        """
+        Update rows whose key is between low and high (see range).
+
+        function receives each row (as a tuple) and returns its new value, or
+        None to leave it unchanged. It must not change key columns.
+        See deleteRange for locking and commit_every.
+        Returns the number of updated rows.
+        """
+        new_tuple = self.getReadTuple()
+        update = libinnodb.ib_cursor_update_row
+        cursor = self._cursor
+        def modify(tpl):
+            new_row = function(tpl.getRow())
+            if new_row is None:
+                return False
+            new_tuple.setRow(new_row)
+            res = update(cursor, tpl._tuple, new_tuple._tuple).value
+            new_tuple.clear()
+            if res != DB_SUCCESS:
+                raise InnoDBError(res)
+            return True
+        return self._modifyRange(low, high, low_inclusive, high_inclusive,
+            commit_every, modify)
+
+    def upsert(self, row):
+        """
+        Insert row, or update the existing row having the same clustered key.
+        Returns True if row was inserted, False if it was updated.
+        """
+        state = self._upsert_state
+        if state is None:
+            self._upsert_state = state = (self.getReadTuple(),
+                self.getReadTuple(), self.getSearchTuple(),
+                self.getKeyPositionList())
+        new_tuple, old_tuple, search_tuple, key_position_list = state
+        new_tuple.setRow(row)
+        try:
+            res = libinnodb.ib_cursor_insert_row(self._cursor,
+                new_tuple._tuple).value
+            if res == DB_SUCCESS:
+                return True
+            if res != libinnodb.DB_DUPLICATE_KEY:
+                raise InnoDBError(res)
+            # Insertion failed, but new_tuple still holds row values: use it
+            # as update target.
+            search_tuple.setRow([row[x] for x in key_position_list])
+            previous_match_mode = self._match_mode
+            self.setMatchMode(libinnodb.IB_EXACT_MATCH)
+            try:
+                if self.tryGoTo(search_tuple) != DB_SUCCESS or \
+                        self.tryRead(old_tuple) != DB_SUCCESS:
+                    # Duplicate is on a unique secondary index.
+                    raise InnoDBError(res)
+            finally:
+                self.setMatchMode(previous_match_mode)
+            cursor_update_row(self._cursor, old_tuple._tuple,
+                new_tuple._tuple)
+            return False
+        finally:
+            new_tuple.clear()
+            old_tuple.clear()
+            search_tuple.clear()
+
+    def upsertMany(self, row_iterable):
+        """
+        Upsert each row from row_iterable.
+        Returns the number of inserted rows and the number of updated rows.
+        """
+        upsert = self.upsert
+        inserted = updated = 0
+        for row in row_iterable:
+            if upsert(row):
+                inserted += 1
+            else:
+                updated += 1
+        return inserted, updated
+
     def delete(self):
         cursor_delete_row(self._cursor)
 
@@ -655,6 +2203,102 @@ class TableCursor(BaseCursor):
             'stat_modified_counter': stats.stat_modified_counter,
         }
 
+    def _fetchKeyDict(self, key_list):
+        """
+        Return a dict mapping each key found in key_list to its row.
+        key_list must be sorted, so consecutive lookups hit neighbour pages.
+        The same search tuple and read tuple are used for all lookups.
+        """
+        result = {}
+        state = self._lookup_state
+        if state is None or state[2] is not self._projection:
+            search_tuple = self.getSearchTuple()
+            tpl = self.getReadTuple()
+            self._lookup_state = state = (search_tuple, tpl,
+                self._projection, self._getRowDecoder(tpl))
+        search_tuple, tpl, _, decode = state
+        go_to = self.tryGoTo
+        read = self.tryRead
+        factory = self._row_factory
+        previous_match_mode = self._match_mode
+        self.setMatchMode(libinnodb.IB_EXACT_MATCH)
+        try:
+            for key in key_list:
+                search_tuple.setRow(key)
+                if go_to(search_tuple, libinnodb.IB_CUR_GE) == DB_SUCCESS and \
+                        read(tpl) == DB_SUCCESS:
+                    row = decode()
+                    if factory is not None:
+                        row = factory(row)
+                    result[key] = row
+                    tpl.clear()
+                search_tuple.clear()
+        finally:
+            self.setMatchMode(previous_match_mode)
+        return result
+
+    def getMany(self, key_list, as_dict=False):
+        """
+        Fetch rows by primary key.
+
+        key_list items are sequences of clustered key column values.
+        Keys are looked up in sorted order (IB_EXACT_MATCH), so consecutive
+        lookups hit the same leaf pages.
+        Returns a list of rows aligned with key_list, None for missing keys,
+        or if as_dict is true a dict mapping found keys (as tuples) to
+        rows.
+        """
+        key_list = [tuple(x) for x in key_list]
+        row_dict = self._fetchKeyDict(sorted(set(key_list)))
+        if as_dict:
+            return row_dict
+        get = row_dict.get
+        return [get(x) for x in key_list]
+
+    def getKeyBoundaryList(self, partition_count, index_name=None):
+        """
+        Return boundaries splitting table in up to partition_count key ranges,
+        for Table.scanParallel and Table.mapReduceParallel.
+
+        Leading key column must be an integer: ranges are interpolated
+        between its first and last values.
+        Partition count is capped by the estimated table row count (when
+        table statistics are available), by the number of distinct leading
+        key values of index_name if given, and by the leading key span
+        (last - first + 1). These caps only bound the number of ranges:
+        as boundaries are interpolated, ranges may still be empty (or
+        unbalanced) when leading key values are sparse or skewed.
+        """
+        if hasattr(libinnodb, 'ib_get_table_statistics'):
+            n_rows = self.getTableStatistics()['stat_n_rows']
+            if n_rows:
+                partition_count = min(partition_count, n_rows)
+        if index_name is not None:
+            n_diff_list = self.getIndexStatNDiffKeyVals(index_name)
+            if n_diff_list:
+                partition_count = min(partition_count, n_diff_list[0])
+        key_position = self.getKeyPositionList()[0]
+        tpl = self.getReadTuple()
+        if self.tryFirst() != DB_SUCCESS or self.tryRead(tpl) != DB_SUCCESS:
+            return []
+        low = tpl[key_position]
+        tpl.clear()
+        if self.tryLast() != DB_SUCCESS or self.tryRead(tpl) != DB_SUCCESS:
+            return []
+        high = tpl[key_position]
+        if not isinstance(low, (int, long)) or \
+                not isinstance(high, (int, long)):
+            raise TypeError('Leading key column is not an integer, provide '
+                'boundaries explicitly')
+        partition_count = max(1, min(partition_count, high - low + 1))
+        step = (high - low + 1) / float(partition_count)
+        result = []
+        for partition in xrange(1, partition_count):
+            boundary = low + int(partition * step)
+            if not result or boundary > result[-1]:
+                result.append(boundary)
+        return result
+
     def getIndexStatNDiffKeyVals(self, index_name):
         return get_index_stat_n_diff_key_vals(self._cursor, index_name)
 
@@ -662,145 +2306,1088 @@ class TableCursor(BaseCursor):
         update_table_statistics(self._cursor)
 
 class IndexCursor(BaseCursor):
+    _table_position_list = None
+    _cluster_access = False
+
     def __init__(self, index_id, transaction, read_only=False):
         self._cursor = cursor = libinnodb.ib_crsr_t()
         cursor_open_index_using_id(index_id, transaction._txn_id,
             ctypes.byref(cursor))
+        self._transaction = transaction
         if read_only:
             self._setSimpleSelect()
 
     def getReadTuple(self):
-        return SecondaryReadTuple(self._cursor)
+        return self._newTuple(SecondaryReadTuple)
 
     def getSearchTuple(self):
-        return SecondarySearchTuple(self._cursor)
-
-_read_int = {
-    (1, libinnodb.IB_COL_UNSIGNED): tuple_read_u8,
-    (1, libinnodb.IB_COL_NONE): tuple_read_i8,
-    (2, libinnodb.IB_COL_UNSIGNED): tuple_read_u16,
-    (2, libinnodb.IB_COL_NONE): tuple_read_i16,
-    (4, libinnodb.IB_COL_UNSIGNED): tuple_read_u32,
-    (4, libinnodb.IB_COL_NONE): tuple_read_i32,
-    (8, libinnodb.IB_COL_UNSIGNED): tuple_read_u64,
-    (8, libinnodb.IB_COL_NONE): tuple_read_i64,
-}
+        return self._newTuple(SecondarySearchTuple)
 
-_write_int = {
-    (1, libinnodb.IB_COL_UNSIGNED): tuple_write_u8,
-    (1, libinnodb.IB_COL_NONE): tuple_write_i8,
-    (2, libinnodb.IB_COL_UNSIGNED): tuple_write_u16,
-    (2, libinnodb.IB_COL_NONE): tuple_write_i16,
-    (4, libinnodb.IB_COL_UNSIGNED): tuple_write_u32,
-    (4, libinnodb.IB_COL_NONE): tuple_write_i32,
-    (8, libinnodb.IB_COL_UNSIGNED): tuple_write_u64,
-    (8, libinnodb.IB_COL_NONE): tuple_write_i64,
+    def setTablePositionList(self, position_list):
+        """
+        Tell which table column each read tuple column holds (None for
+        columns only holding a prefix of a table column).
+        See TableSchema.getSecondaryReadPositionList and
+        Table.openSecondaryIndex .
+        Index metadata does not tell which table column an index column
+        comes from (nor whether it is a prefix), so this is required before
+        setting a projection.
+        """
+        self._table_position_list = tuple(position_list)
+
+    def isCovering(self, position_list):
+        """
+        Tell whether all given table columns can be read from this index
+        alone, without accessing clustered index.
+        Raises ValueError if table positions are unknown, see
+        setTablePositionList .
+        """
+        table_position_list = self._table_position_list
+        if table_position_list is None:
+            raise ValueError('Unknown index column table positions, see '
+                'setTablePositionList')
+        return all(x in table_position_list for x in position_list)
+
+    def setProjection(self, position_list):
+        """
+        Only return given table columns (positions in table rows) in rows
+        produced by fetch*, iterRows, range and iterPrefix.
+
+        If this index covers all of them, they are read from secondary index
+        records only. Otherwise, clustered index access is enabled for this
+        cursor (and stays enabled), and they are read from clustered
+        records.
+        Requires table positions of index columns, see setTablePositionList.
+        None (default) returns all secondary index read tuple columns.
+        """
+        if position_list is not None and not self.isCovering(
+                position_list) and not self._cluster_access:
+            libinnodb.ib_cursor_set_cluster_access(self._cursor)
+            self._cluster_access = True
+        super(IndexCursor, self).setProjection(position_list)
+
+    def _getRowDecoder(self, tpl):
+        projection = self._projection
+        if projection is None:
+            return tpl.getRow
+        if self.isCovering(projection):
+            index = self._table_position_list.index
+            reader = tpl._codec.getReader([index(x) for x in projection])
+            return lambda: reader(tpl._tuple)
+        acquire = self.acquireClusterReadTuple
+        release = self.releaseTuple
+        cluster_tuple = acquire()
+        reader = cluster_tuple._codec.getReader(projection)
+        release(cluster_tuple)
+        read = self.read
+        def decode():
+            cluster_tuple = acquire()
+            try:
+                read(cluster_tuple)
+                return reader(cluster_tuple._tuple)
+            finally:
+                release(cluster_tuple)
+        return decode
+
+    def acquireClusterReadTuple(self):
+        """
+        Return a clustered index read tuple from cursor's tuple pool, for
+        reads with clustered index access enabled. See acquireReadTuple .
+        """
+        return self._acquireTuple('cluster', lambda: self._newTuple(
+            ClusterReadTuple))
+
+    def lookupRows(self, key_list, table_cursor):
+        """
+        Return full table rows matching each secondary key from key_list.
+
+        key_list items are sequences of secondary index column values
+        (possibly only the leading ones). table_cursor is a TableCursor on
+        the same table.
+        Clustered keys of all secondary index hits are collected first, then
+        deduplicated and fetched in clustered key order, so table pages are
+        accessed mostly sequentially.
+        Returns a list of lists of rows, aligned with key_list.
+        """
+        cluster_key_dict = {}
+        with self.pooledReadTuple() as read_tuple:
+            for key in sorted(set(tuple(x) for x in key_list)):
+                cluster_key_list = cluster_key_dict[key] = []
+                for tpl in self._iterPrefixTuple(key, read_tuple):
+                    cluster_key_list.append(
+                        tpl.getClusterKeyTuple().getRow())
+        row_dict = table_cursor._fetchKeyDict(sorted(set(
+            cluster_key
+            for cluster_key_list in cluster_key_dict.itervalues()
+            for cluster_key in cluster_key_list
+        )))
+        result = []
+        for key in key_list:
+            result.append([row_dict[x]
+                for x in cluster_key_dict[tuple(key)] if x in row_dict])
+        return result
+
+class CursorCache(object):
+    """
+    Per-thread cache of open cursors, by table, index and read-only flag.
+
+    Instead of being closed at the end of a unit of work, a cursor is reset
+    and kept, then attached to the transaction of the next unit of work
+    wanting it in the same thread. This avoids looking table and index up by
+    name and recomputing tuple layouts.
+    Cursor settings (projection, row factory, key positions, codecs...) are
+    kept as well, so they should be the same for all users of a given table
+    or index.
+    At most max_idle reset cursors are kept per thread.
+    """
+    def __init__(self, max_idle=16):
+        self._max_idle = max_idle
+        self._local = threading.local()
+
+    def _getIdleDict(self):
+        try:
+            return self._local.idle_dict
+        except AttributeError:
+            self._local.idle_dict = result = {}
+            self._local.idle_count = 0
+            return result
+
+    def _get(self, key, transaction):
+        idle_list = self._getIdleDict().get(key)
+        if idle_list:
+            cursor = idle_list.pop()
+            self._local.idle_count -= 1
+            cursor.attachTransaction(transaction)
+            return cursor
+        return None
+
+    def openTable(self, table, transaction, read_only=False):
+        """
+        Return a TableCursor on table, within transaction.
+        It must be given back with release before transaction ends.
+        """
+        key = (table._name, None, read_only)
+        cursor = self._get(key, transaction)
+        if cursor is None:
+            cursor = table.open(transaction, read_only=read_only)
+            cursor._cache_key = key
+        return cursor
+
+    def openSecondaryIndex(self, table, name, transaction, read_only=False,
+            table_position_list=None):
+        """
+        Return an IndexCursor on given index of table, within transaction.
+        It must be given back with release before transaction ends.
+        table_position_list is only used when a new cursor is opened, see
+        Table.openSecondaryIndex .
+        """
+        key = (table._name, name, read_only)
+        cursor = self._get(key, transaction)
+        if cursor is None:
+            cursor = table.openSecondaryIndex(transaction, name,
+                read_only=read_only, table_position_list=table_position_list)
+            cursor._cache_key = key
+        return cursor
+
+    def release(self, cursor):
+        """
+        Reset cursor and keep it for reuse in current thread, or close it if
+        enough cursors are already kept.
+        cursor must come from openTable or openSecondaryIndex, otherwise
+        ValueError is raised.
+        """
+        if cursor._cache_key is None:
+            raise ValueError('Cursor was not opened by a CursorCache')
+        cursor.reset()
+        cursor._transaction = None
+        idle_dict = self._getIdleDict()
+        if self._local.idle_count < self._max_idle:
+            idle_dict.setdefault(cursor._cache_key, []).append(cursor)
+            self._local.idle_count += 1
+        else:
+            cursor.close()
+
+    @contextlib.contextmanager
+    def table(self, table, transaction, read_only=False):
+        """
+        Context manager version of openTable and release.
+        """
+        cursor = self.openTable(table, transaction, read_only)
+        try:
+            yield cursor
+        finally:
+            self.release(cursor)
+
+    @contextlib.contextmanager
+    def secondaryIndex(self, table, name, transaction, read_only=False,
+            table_position_list=None):
+        """
+        Context manager version of openSecondaryIndex and release.
+        """
+        cursor = self.openSecondaryIndex(table, name, transaction, read_only,
+            table_position_list)
+        try:
+            yield cursor
+        finally:
+            self.release(cursor)
+
+    def clear(self):
+        """
+        Close cursors kept for current thread.
+        """
+        idle_dict = self._getIdleDict()
+        for idle_list in idle_dict.itervalues():
+            for cursor in idle_list:
+                cursor.close()
+        idle_dict.clear()
+        self._local.idle_count = 0
+
+# Column value codecs, transforming string-ish column values when they
+# are written to (encode) and read from (decode) tuples.
+# See TableSchema.addColumn and BaseCursor.setColumnCodecDict .
+
+class PassThroughColumnCodec(object):
+    """
+    Store values as they are. For columns holding small values, not worth
+    compressing.
+    """
+    def encode(self, value):
+        return value
+
+    def decode(self, data):
+        return data
+
+class ZlibColumnCodec(object):
+    """
+    Store values compressed with zlib at given level.
+
+    Values shorter than min_length, or which do not shrink, are stored
+    uncompressed. A one-byte header tells both apart.
+    """
+    _marker = '\x01'
+
+    def __init__(self, level=6, min_length=64):
+        self._level = level
+        self._min_length = min_length
+
+    def _compress(self, value):
+        return zlib.compress(value, self._level)
+
+    def _decompress(self, data):
+        return zlib.decompress(data)
+
+    def encode(self, value):
+        if len(value) >= self._min_length:
+            compressed = self._compress(value)
+            if len(compressed) + 1 < len(value):
+                return self._marker + compressed
+        return '\x00' + value
+
+    def decode(self, data):
+        marker = data[:1]
+        if marker == self._marker:
+            return self._decompress(data[1:])
+        if marker == '\x00':
+            return data[1:]
+        raise ValueError('Unexpected codec header: %r' % (marker, ))
+
+class ZlibDictColumnCodec(ZlibColumnCodec):
+    """
+    Like ZlibColumnCodec, with a preset dictionary of content expected to
+    be common among values (see train_zlib_dictionary), so small values
+    compress well too.
+
+    Values must be decoded with the same dictionary they were encoded with.
+    """
+    _marker = '\x02'
+
+    def __init__(self, dictionary, level=6, min_length=16):
+        super(ZlibDictColumnCodec, self).__init__(level, min_length)
+        # Stream compressors primed with the dictionary, copied for each
+        # value so values can refer to dictionary content.
+        self._compressor = compressor = zlib.compressobj(level)
+        primed = compressor.compress(dictionary) + compressor.flush(
+            zlib.Z_SYNC_FLUSH)
+        self._decompressor = decompressor = zlib.decompressobj()
+        decompressor.decompress(primed)
+
+    def _compress(self, value):
+        compressor = self._compressor.copy()
+        return compressor.compress(value) + compressor.flush()
+
+    def _decompress(self, data):
+        decompressor = self._decompressor.copy()
+        return decompressor.decompress(data) + decompressor.flush()
+
+def train_zlib_dictionary(sample_iterable, size=32768, chunk_length=16):
+    """
+    Build a ZlibDictColumnCodec dictionary from sample values.
+
+    Keeps the chunk_length-bytes substrings found in the most samples, up to
+    size bytes, most common last as deflate encodes closer matches in fewer
+    bits.
+    """
+    count_dict = {}
+    step = max(chunk_length // 2, 1)
+    for sample in sample_iterable:
+        for chunk in set(sample[x:x + chunk_length]
+                for x in xrange(0, max(len(sample) - chunk_length, 0) + 1,
+                    step)):
+            count_dict[chunk] = count_dict.get(chunk, 0) + 1
+    chunk_list = []
+    total = 0
+    for chunk in sorted((x for x, y in count_dict.iteritems() if y > 1),
+            key=count_dict.get, reverse=True):
+        if total + len(chunk) > size:
+            break
+        chunk_list.append(chunk)
+        total += len(chunk)
+    chunk_list.reverse()
+    return ''.join(chunk_list)
+
+_int_codec_dict = {
+    (1, libinnodb.IB_COL_UNSIGNED): (libinnodb.ib_tuple_read_u8,
+        libinnodb.ib_tuple_write_u8, libinnodb.ib_u8_t),
+    (1, libinnodb.IB_COL_NONE): (libinnodb.ib_tuple_read_i8,
+        libinnodb.ib_tuple_write_i8, libinnodb.ib_i8_t),
+    (2, libinnodb.IB_COL_UNSIGNED): (libinnodb.ib_tuple_read_u16,
+        libinnodb.ib_tuple_write_u16, libinnodb.ib_u16_t),
+    (2, libinnodb.IB_COL_NONE): (libinnodb.ib_tuple_read_i16,
+        libinnodb.ib_tuple_write_i16, libinnodb.ib_i16_t),
+    (4, libinnodb.IB_COL_UNSIGNED): (libinnodb.ib_tuple_read_u32,
+        libinnodb.ib_tuple_write_u32, libinnodb.ib_u32_t),
+    (4, libinnodb.IB_COL_NONE): (libinnodb.ib_tuple_read_i32,
+        libinnodb.ib_tuple_write_i32, libinnodb.ib_i32_t),
+    (8, libinnodb.IB_COL_UNSIGNED): (libinnodb.ib_tuple_read_u64,
+        libinnodb.ib_tuple_write_u64, libinnodb.ib_u64_t),
+    (8, libinnodb.IB_COL_NONE): (libinnodb.ib_tuple_read_i64,
+        libinnodb.ib_tuple_write_i64, libinnodb.ib_i64_t),
 }
 
+_string_type_set = frozenset((
+    libinnodb.IB_CHAR,
+    libinnodb.IB_BLOB,
+    libinnodb.IB_DECIMAL,
+    libinnodb.IB_VARCHAR,
+    libinnodb.IB_BINARY,
+    libinnodb.IB_VARBINARY,
+))
+
+# Column codec factories.
+# Each returns a (reader, writer) pair for given column.
+# reader(tpl, data_len) returns column value, data_len being known to not be
+# IB_SQL_NULL.
+# writer(tpl, value) stores value, which is known to not be None.
+# Fixed-size values go through a scratch ctypes value allocated once per
+# column.
+
+def _newScalarCodec(index, raw_read, raw_write, c_type):
+    read_value = c_type()
+    read_value_p = ctypes.byref(read_value)
+    write_value = c_type()
+    def reader(tpl, data_len):
+        res = raw_read(tpl, index, read_value_p).value
+        if res != DB_SUCCESS:
+            raise InnoDBError(res)
+        return read_value.value
+    def writer(tpl, value):
+        write_value.value = value
+        res = raw_write(tpl, index, write_value).value
+        if res != DB_SUCCESS:
+            raise InnoDBError(res)
+    return reader, writer
+
+def _newStringCodec(index):
+    string_at = ctypes.string_at
+    raw_get_value = libinnodb.ib_col_get_value
+    raw_set_value = libinnodb.ib_col_set_value
+    def reader(tpl, data_len):
+        return string_at(raw_get_value(tpl, index), data_len)
+    def writer(tpl, value):
+        res = raw_set_value(tpl, index, value, len(value)).value
+        if res != DB_SUCCESS:
+            raise InnoDBError(res)
+    return reader, writer
+
+def _newUnsupportedCodec(index, col_type):
+    def reader(tpl, data_len):
+        raise NotImplementedError(repr(col_type))
+    def writer(tpl, value):
+        raise NotImplementedError(repr(col_type))
+    return reader, writer
+
+def _newValueCodec(reader, writer, value_codec):
+    encode = value_codec.encode
+    decode = value_codec.decode
+    def codec_reader(tpl, data_len):
+        return decode(reader(tpl, data_len))
+    def codec_writer(tpl, value):
+        writer(tpl, encode(value))
+    return codec_reader, codec_writer
+
+def _newColumnCodec(index, col_type, attr, type_len):
+    if col_type == libinnodb.IB_INT:
+        raw_read, raw_write, c_type = _int_codec_dict[type_len,
+            attr & libinnodb.IB_COL_UNSIGNED]
+        return _newScalarCodec(index, raw_read, raw_write, c_type)
+    if col_type == libinnodb.IB_FLOAT:
+        return _newScalarCodec(index, libinnodb.ib_tuple_read_float,
+            libinnodb.ib_tuple_write_float, ctypes.c_float)
+    if col_type == libinnodb.IB_DOUBLE:
+        return _newScalarCodec(index, libinnodb.ib_tuple_read_double,
+            libinnodb.ib_tuple_write_double, ctypes.c_double)
+    if col_type in _string_type_set:
+        return _newStringCodec(index)
+    return _newUnsupportedCodec(index, col_type)
+
+class RowCodec(object):
+    """
+    Per-column readers and writers, prebound to their column.
+
+    Built once per column layout. Reads and writes do not have to look at
+    column type again, and full-row conversions are a single loop over
+    columns.
+    Not thread-safe: scratch values are shared by all tuples of a layout.
+    """
+    def __init__(self, column_list, value_codec_dict=None):
+        """
+        value_codec_dict
+          Maps column positions to value codecs (see ZlibColumnCodec) for
+          string-ish columns whose values are transformed when stored.
+        """
+        self.column_list = column_list
+        self.reader_list = reader_list = []
+        self.writer_list = writer_list = []
+        for position, column in enumerate(column_list):
+            index = column[0]
+            reader, writer = _newColumnCodec(*column)
+            if value_codec_dict and position in value_codec_dict:
+                if column[1] not in _string_type_set:
+                    raise TypeError('Value codec on non-string column %i' % (
+                        position, ))
+                reader, writer = _newValueCodec(reader, writer,
+                    value_codec_dict[position])
+            reader_list.append((index, reader))
+            writer_list.append((index, writer))
+
+    def readColumn(self, tpl, column):
+        index, reader = self.reader_list[column]
+        data_len = col_get_len(tpl, index)
+        if data_len == libinnodb.IB_SQL_NULL:
+            return None
+        return reader(tpl, data_len)
+
+    def writeColumn(self, tpl, column, value):
+        index, writer = self.writer_list[column]
+        if value is None:
+            col_set_value(tpl, index, None, libinnodb.IB_SQL_NULL)
+        else:
+            writer(tpl, value)
+
+    def getReader(self, position_list):
+        """
+        Return a function returning a tuple of the values of columns at given
+        positions from a tuple.
+        """
+        item_list = [self.reader_list[x] for x in position_list]
+        get_len = col_get_len
+        null = libinnodb.IB_SQL_NULL
+        def reader(tpl):
+            result = []
+            append = result.append
+            for index, column_reader in item_list:
+                data_len = get_len(tpl, index)
+                if data_len == null:
+                    append(None)
+                else:
+                    append(column_reader(tpl, data_len))
+            return tuple(result)
+        return reader
+
+    def getKeyReader(self, position_list):
+        """
+        Return a function extracting from a tuple the values of columns at
+        given positions, in a form which compares like InnoDB orders them:
+        stored bytes (big-endian integers with flipped sign bit, strings in
+        binary collation), or decoded value for floating point types, None
+        for NULL.
+        This avoids decoding when only comparing keys.
+        """
+        string_at = ctypes.string_at
+        get_value = libinnodb.ib_col_get_value
+        get_len = col_get_len
+        null = libinnodb.IB_SQL_NULL
+        item_list = []
+        for position in position_list:
+            index, col_type = self.column_list[position][:2]
+            if col_type in (libinnodb.IB_FLOAT, libinnodb.IB_DOUBLE):
+                decoder = self.reader_list[position][1]
+            else:
+                decoder = None
+            item_list.append((index, decoder))
+        def reader(tpl):
+            result = []
+            append = result.append
+            for index, decoder in item_list:
+                data_len = get_len(tpl, index)
+                if data_len == null:
+                    append(None)
+                elif decoder is None:
+                    append(string_at(get_value(tpl, index), data_len))
+                else:
+                    append(decoder(tpl, data_len))
+            return tuple(result)
+        return reader
+
+    def read(self, tpl):
+        """
+        Return a tuple of all column values.
+        """
+        get_len = col_get_len
+        null = libinnodb.IB_SQL_NULL
+        result = []
+        append = result.append
+        for index, reader in self.reader_list:
+            data_len = get_len(tpl, index)
+            if data_len == null:
+                append(None)
+            else:
+                append(reader(tpl, data_len))
+        return tuple(result)
+
+    def write(self, tpl, row):
+        """
+        Store all values from row (a sequence, in column order).
+        Extra columns are left untouched.
+        """
+        null = libinnodb.IB_SQL_NULL
+        for (index, writer), value in zip(self.writer_list, row):
+            if value is None:
+                col_set_value(tpl, index, None, null)
+            else:
+                writer(tpl, value)
+
+class ColumnLayout(object):
+    """
+    Immutable description of the user columns of a tuple.
+
+    Computed once from tuple metadata, then shared by all tuples of the same
+    kind created from the same cursor, so tuple accesses do not need to
+    query column metadata again.
+    column_list items are (tuple column number, type, attributes, type length)
+    for each non-system column, in tuple order.
+    codec is the RowCodec for these columns, applying value codecs from
+    value_codec_dict (see RowCodec).
+    """
+    __slots__ = ('n_cols', 'column_list', 'codec')
+
+    def __init__(self, tpl, value_codec_dict=None):
+        column_list = []
+        append = column_list.append
+        self.n_cols = n_cols = tuple_get_n_cols(tpl)
+        for index in xrange(n_cols):
+            _, col_meta = col_get_meta(tpl, index)
+            col_type = col_meta.type
+            if col_type == libinnodb.IB_SYS:
+                continue
+            append((index, col_type, col_meta.attr, col_meta.type_len))
+        self.column_list = column_list = tuple(column_list)
+        self.codec = RowCodec(column_list, value_codec_dict)
+
+    def __len__(self):
+        return len(self.column_list)
+
+class ColumnBuffer(object):
+    """
+    Checked access to a column value stored in a tuple, without copying it.
+
+    Any access raises ValueError once the tuple was cleared or modified
+    after this buffer was created (which happens when iteration helpers move
+    the cursor).
+    See BaseTuple.getBuffer .
+    """
+    __slots__ = ('_tpl', '_generation', '_view')
+
+    def __init__(self, tpl, view):
+        self._tpl = tpl
+        self._generation = tpl._generation
+        self._view = view
+
+    def isValid(self):
+        return self._generation == self._tpl._generation
+
+    def getView(self):
+        """
+        Return a memoryview of column value.
+        It is not checked anymore, so it must not be kept.
+        """
+        if self._generation != self._tpl._generation:
+            raise ValueError('Tuple changed since buffer was created')
+        return self._view
+
+    def __len__(self):
+        return len(self.getView())
+
+    def __getitem__(self, index):
+        return self.getView()[index]
+
+    def tobytes(self):
+        return self.getView().tobytes()
+
+    __str__ = tobytes
+
+_empty_view = memoryview('')
+
+class BlobReader(object):
+    """
+    Read-only file-like access to a string-ish column value, in chunks.
+
+    Value is read from tuple memory as chunks are requested, so it never
+    needs to exist as a whole Python string.
+    Raises ValueError once the tuple was cleared or modified.
+    See BaseTuple.getBlobReader .
+    """
+    def __init__(self, tpl, index, length):
+        self._tpl = tpl
+        self._generation = tpl._generation
+        self._index = index
+        self._length = length
+        self._position = 0
+
+    def _getAddress(self):
+        tpl = self._tpl
+        if self._generation != tpl._generation:
+            raise ValueError('Tuple changed since reader was created')
+        return col_get_value(tpl._tuple, self._index)
+
+    def __len__(self):
+        return self._length
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._position
+        elif whence == 2:
+            offset += self._length
+        if offset < 0:
+            raise ValueError('Negative position')
+        self._position = offset
+
+    def read(self, size=-1):
+        position = self._position
+        remaining = self._length - position
+        if size < 0 or size > remaining:
+            size = remaining
+        if size <= 0:
+            return ''
+        result = ctypes.string_at(self._getAddress() + position, size)
+        self._position = position + size
+        return result
+
+    def readinto(self, buffer):
+        """
+        Read up to len(buffer) bytes into buffer (a writable buffer, like
+        bytearray or array.array).
+        Returns the number of bytes read, 0 at end of value.
+        """
+        position = self._position
+        size = min(len(buffer) * getattr(buffer, 'itemsize', 1),
+            self._length - position)
+        if size <= 0:
+            return 0
+        ctypes.memmove((ctypes.c_char * size).from_buffer(buffer),
+            self._getAddress() + position, size)
+        self._position = position + size
+        return size
+
+    def iterChunks(self, chunk_size=65536):
+        """
+        Iterate over value chunks of at most chunk_size bytes, from current
+        position.
+        """
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        self._tpl = None
+
+class BlobWriter(object):
+    """
+    Write-only file-like access to a string-ish column value of known
+    length, filled in chunks.
+
+    Column is sized once in the tuple, then each chunk is copied directly
+    to its place in tuple memory, so the value never exists in memory
+    anywhere else. Closing before exactly length bytes were written raises
+    ValueError, and sets column to NULL.
+    Raises ValueError if the tuple is cleared or modified while writing.
+    See BaseTuple.getBlobWriter .
+    """
+    def __init__(self, tpl, index, length):
+        raw_tuple = tpl._tuple
+        if length:
+            # Anonymous mapping pages are only allocated when written to:
+            # copying from it does not allocate a second copy of the value.
+            zero = mmap.mmap(-1, length)
+            try:
+                source = (ctypes.c_char * length).from_buffer(zero)
+                col_set_value(raw_tuple, index, source, length)
+                del source
+            finally:
+                zero.close()
+        else:
+            col_set_value(raw_tuple, index, '', 0)
+        tpl._generation += 1
+        self._tpl = tpl
+        self._generation = tpl._generation
+        self._index = index
+        self._length = length
+        self._position = 0
+
+    def tell(self):
+        return self._position
+
+    def write(self, data):
+        tpl = self._tpl
+        if tpl is None:
+            raise ValueError('Writer is closed')
+        if self._generation != tpl._generation:
+            raise ValueError('Tuple changed since writer was created')
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        elif not isinstance(data, str):
+            data = str(data)
+        position = self._position
+        size = len(data)
+        if position + size > self._length:
+            raise ValueError('Writing past declared length')
+        ctypes.memmove(col_get_value(tpl._tuple, self._index) + position,
+            data, size)
+        self._position = position + size
+
+    def _abort(self):
+        tpl = self._tpl
+        if tpl is not None:
+            self._tpl = None
+            if self._generation == tpl._generation:
+                tpl._generation += 1
+                col_set_value(tpl._tuple, self._index, None,
+                    libinnodb.IB_SQL_NULL)
+
+    def close(self):
+        if self._tpl is None:
+            return
+        if self._position != self._length:
+            self._abort()
+            raise ValueError('Declared length %i, %i bytes written' % (
+                self._length, self._position))
+        self._tpl = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._abort()
+
 class BaseTuple(object):
     _tuple = None
+    # Incremented whenever tuple content changes, see ColumnBuffer.
+    _generation = 0
+    # Set on tuples created by BaseCursor.acquireReadTuple & co.
+    _pool_key = None
+    _released = False
 
-    def __init__(self, tpl):
+    def __init__(self, tpl, layout=None):
         if not tpl:
             raise ValueError('Could not instanciate tuple')
         self._tuple = tpl
-        self._update()
-
-    def _update(self):
-        self._col_data_list = col_data_list = []
-        col_data_append = col_data_list.append
-        for index in xrange(tuple_get_n_cols(self._tuple)):
-            data_len, col_meta = col_get_meta(self._tuple, index)
-            if col_meta.type == libinnodb.IB_SYS:
-                continue
-            col_data_append((index, data_len, col_meta))
-        self._len = len(col_data_list)
+        if layout is None or layout.n_cols != tuple_get_n_cols(tpl):
+            layout = ColumnLayout(tpl)
+        self._setLayout(layout)
+
+    def _setLayout(self, layout):
+        self._layout = layout
+        self._column_list = layout.column_list
+        self._codec = layout.codec
 
     def clear(self):
+        self._generation += 1
         new_tuple = tuple_clear(self._tuple)
         if not new_tuple:
             raise ValueError('Out of memory ?')
         self._tuple = new_tuple
 
     def copy(self, src):
+        self._generation += 1
         tuple_copy(self._tuple, src._tuple)
 
     def __getitem__(self, index):
-        index, data_len, col_meta = self._col_data_list[index]
-        col_type = col_meta.type
+        return self._codec.readColumn(self._tuple, index)
+
+    def __setitem__(self, index, value):
+        self._generation += 1
+        self._codec.writeColumn(self._tuple, index, value)
+
+    def getBuffer(self, column, safe=True):
+        """
+        Return value of a string-ish (CHAR, VARCHAR, BINARY, VARBINARY, BLOB,
+        DECIMAL) column without copying it, or None if it is NULL.
+
+        Value is only valid until tuple is cleared or modified.
+        If safe is true, a ColumnBuffer is returned, refusing access once
+        value became invalid. Otherwise, a bare memoryview is returned, and
+        it is up to the caller to not use it past that point.
+        """
+        index = self._getStringColumnIndex(column)
+        tpl = self._tuple
+        data_len = col_get_len(tpl, index)
         if data_len == libinnodb.IB_SQL_NULL:
-            result = None
-        elif col_type == libinnodb.IB_INT:
-            result = _read_int[col_meta.type_len,
-                col_meta.attr & libinnodb.IB_COL_UNSIGNED](
-                self._tuple, index)
-        elif col_type == libinnodb.IB_FLOAT:
-            result = tuple_read_float(self._tuple, index)
-        elif col_type == libinnodb.IB_DOUBLE:
-            result = tuple_read_double(self._tuple, index)
-        elif col_type in (libinnodb.IB_CHAR, libinnodb.IB_BLOB,
-                libinnodb.IB_DECIMAL, libinnodb.IB_VARCHAR,
-                libinnodb.IB_BINARY, libinnodb.IB_VARBINARY):
-            result = ctypes.string_at(col_get_value(
-                self._tuple, index), data_len)
+            return None
+        if data_len:
+            array = (ctypes.c_char * data_len).from_address(
+                col_get_value(tpl, index))
+            # Keep tuple memory allocated as long as the view exists.
+            array._owner = self
+            view = memoryview(array)
         else:
-            raise NotImplementedError(repr(col_type))
+            view = _empty_view
+        if safe:
+            return ColumnBuffer(self, view)
+        return view
+
+    def _getStringColumnIndex(self, column):
+        index, col_type = self._column_list[column][:2]
+        if col_type not in _string_type_set:
+            raise TypeError('Not a string column: %r' % (col_type, ))
+        return index
+
+    def getBlobReader(self, column):
+        """
+        Return a BlobReader on value of a string-ish column, to read it in
+        chunks, or None if it is NULL.
+        """
+        index = self._getStringColumnIndex(column)
+        data_len = col_get_len(self._tuple, index)
+        if data_len == libinnodb.IB_SQL_NULL:
+            return None
+        return BlobReader(self, index, data_len)
+
+    def getBlobWriter(self, column, length):
+        """
+        Return a BlobWriter to set value of a string-ish column in chunks.
+        length is the total value length.
+        """
+        return BlobWriter(self, self._getStringColumnIndex(column), length)
+
+    def setBlobFromFile(self, column, source, length, chunk_size=65536):
+        """
+        Set value of a string-ish column from length bytes read from source
+        file-like object, chunk_size bytes at a time.
+        """
+        writer = self.getBlobWriter(column, length)
+        read = source.read
+        remaining = length
+        while remaining:
+            chunk = read(min(chunk_size, remaining))
+            if not chunk:
+                raise ValueError('Source ended %i bytes early' % (remaining, ))
+            writer.write(chunk)
+            remaining -= len(chunk)
+        writer.close()
+
+    def readinto(self, column, buffer, offset=0):
+        """
+        Copy column value into buffer (a writable buffer, like bytearray or
+        array.array) at given byte offset, without allocating a string.
+        Integers and floats are copied in machine format.
+        Returns the number of bytes copied, or None if value is NULL.
+        Raises ValueError if value does not fit.
+        """
+        return self.readManyInto((column, ), buffer, offset)[0]
+
+    def readManyInto(self, position_list, buffer, offset=0):
+        """
+        Copy values of columns at given positions one after the other into
+        buffer, starting at given byte offset. See readinto.
+        Returns the list of copied lengths, None for NULL values.
+        Raises ValueError if values do not fit, in which case buffer content
+        is undefined.
+        """
+        tpl = self._tuple
+        column_list = self._column_list
+        get_len = col_get_len
+        copy_value = col_copy_value
+        null = libinnodb.IB_SQL_NULL
+        available = len(buffer) * getattr(buffer, 'itemsize', 1) - offset
+        array = (ctypes.c_char * available).from_buffer(buffer, offset)
+        address = ctypes.addressof(array)
+        result = []
+        append = result.append
+        for position in position_list:
+            index = column_list[position][0]
+            data_len = get_len(tpl, index)
+            if data_len == null:
+                append(None)
+                continue
+            if data_len > available:
+                raise ValueError('Buffer too small')
+            copy_value(tpl, index, address, data_len)
+            address += data_len
+            available -= data_len
+            append(data_len)
         return result
 
-    def __setitem__(self, index, value):
-        index, data_len, col_meta = self._col_data_list[index]
-        col_type = col_meta.type
-        if value is None:
-            col_set_value(self._tuple, index, None, IB_SQL_NULL)
-        elif col_type == libinnodb.IB_INT:
-            _write_int[col_meta.type_len,
-                col_meta.attr & libinnodb.IB_COL_UNSIGNED](
-                self._tuple, index, value)
-        elif col_type == libinnodb.IB_FLOAT:
-            tuple_write_float(self._tuple, index, value)
-        elif col_type == libinnodb.IB_DOUBLE:
-            tuple_write_double(self._tuple, index, value)
-        elif col_type in (libinnodb.IB_CHAR, libinnodb.IB_BLOB,
-                libinnodb.IB_DECIMAL, libinnodb.IB_VARCHAR,
-                libinnodb.IB_BINARY, libinnodb.IB_VARBINARY):
-            col_set_value(self._tuple, index, value, len(value))
-        else:
-            raise NotImplementedError(repr(col_type))
-        self._update()
+    def getRow(self):
+        """
+        Return all column values as a tuple.
+        """
+        return self._codec.read(self._tuple)
+
+    def setRow(self, row):
+        """
+        Set column values from given sequence, in column order.
+        """
+        self._generation += 1
+        self._codec.write(self._tuple, row)
 
     def __len__(self):
-        return self._len
+        return len(self._column_list)
 
     def __del__(self):
         if _is_started and self._tuple:
             libinnodb.ib_tuple_delete(self._tuple)
             del self._tuple
 
+_undecoded = object()
+
+class LazyRow(object):
+    """
+    Row decoding its columns on first access, and caching decoded values.
+
+    Reads from a tuple whose content must not change while the row is
+    attached to it. Call detach to give the row its own copy of the tuple,
+    so it remains usable after cursor moved.
+    """
+    __slots__ = ('_source', '_codec', '_value_list', '_new_tuple')
+
+    def __init__(self, tpl, new_tuple):
+        """
+        tpl (BaseTuple)
+          Tuple to read columns from.
+        new_tuple (callable)
+          Returns an empty tuple of the same kind as tpl, used by detach.
+        """
+        self._source = tpl
+        self._codec = tpl._codec
+        self._value_list = [_undecoded] * len(tpl)
+        self._new_tuple = new_tuple
+
+    def _invalidate(self, tpl):
+        # Called by the owner of tpl before reusing it.
+        if self._source is tpl:
+            self._source = None
+
+    def isDetached(self):
+        return self._new_tuple is None
+
+    def detach(self):
+        """
+        Copy source tuple, unless all columns are already decoded.
+        Returns self.
+        """
+        if self._new_tuple is not None:
+            if _undecoded in self._value_list:
+                source = self._source
+                if source is None:
+                    raise ValueError('Row source tuple changed before detach')
+                tpl = self._new_tuple()
+                tpl.copy(source)
+                self._source = tpl
+            else:
+                self._source = None
+            self._new_tuple = None
+        return self
+
+    def copy(self):
+        """
+        Return a detached copy of this row, sharing already decoded values.
+        """
+        result = LazyRow.__new__(LazyRow)
+        result._source = self._source
+        result._codec = self._codec
+        result._value_list = self._value_list[:]
+        result._new_tuple = self._new_tuple
+        return result.detach()
+
+    def __len__(self):
+        return len(self._value_list)
+
+    def __getitem__(self, column):
+        if isinstance(column, slice):
+            return tuple(self[x]
+                for x in xrange(*column.indices(len(self._value_list))))
+        value_list = self._value_list
+        value = value_list[column]
+        if value is _undecoded:
+            source = self._source
+            if source is None:
+                raise ValueError('Row source tuple changed before detach')
+            value_list[column] = value = self._codec.readColumn(
+                source._tuple, column % len(value_list))
+        return value
+
+    def __iter__(self):
+        for column in xrange(len(self._value_list)):
+            yield self[column]
+
+    def getRow(self):
+        """
+        Return all column values as a tuple.
+        """
+        return tuple(self)
+
+    def __repr__(self):
+        return '<%s %r>' % (self.__class__.__name__, [
+            '?' if x is _undecoded else x for x in self._value_list])
+
 class ClusterReadTuple(BaseTuple):
-    def __init__(self, cursor):
+    def __init__(self, cursor, layout=None):
         super(ClusterReadTuple, self).__init__(
-            clust_read_tuple_create(cursor))
+            clust_read_tuple_create(cursor), layout)
 
-def ClusterSearchTuple(cursor):
-    return _ClusterSearchTuple(clust_search_tuple_create(cursor))
+def ClusterSearchTuple(cursor, layout=None):
+    return _ClusterSearchTuple(clust_search_tuple_create(cursor), layout)
 
 class _ClusterSearchTuple(BaseTuple):
-    def __init__(self, tpl):
-        super(_ClusterSearchTuple, self).__init__(tpl)
+    def __init__(self, tpl, layout=None):
+        super(_ClusterSearchTuple, self).__init__(tpl, layout)
 
 class SecondaryReadTuple(BaseTuple):
-    def __init__(self, cursor):
+    _cluster_key_layout = None
+
+    def __init__(self, cursor, layout=None):
         self._cursor = cursor
         super(SecondaryReadTuple, self).__init__(
-            sec_read_tuple_create(cursor))
+            sec_read_tuple_create(cursor), layout)
 
     def getClusterKeyTuple(self):
         cluster_key_tuple = libinnodb.ib_tpl_t()
-        tuple_get_cluster_key(self._cursor, byref(cluster_key_tuple), self._tuple)
-        return _ClusterSearchTuple(cluster_key_tuple)
+        tuple_get_cluster_key(self._cursor, ctypes.byref(cluster_key_tuple),
+            self._tuple)
+        result = _ClusterSearchTuple(cluster_key_tuple,
+            self._cluster_key_layout)
+        self._cluster_key_layout = result._layout
+        return result
 
 class SecondarySearchTuple(BaseTuple):
-    def __init__(self, cursor):
+    def __init__(self, cursor, layout=None):
         super(SecondarySearchTuple, self).__init__(
-            sec_search_tuple_create(cursor))
-
+            sec_search_tuple_create(cursor), layout)